@@ -0,0 +1,555 @@
+import enum
+import math
+from typing import Any, Callable, Optional
+from expression import Block, Builtin, Constant, Expression, ForLoop, Function, IfBlock, Invocation, Name, Operation, WhileLoop
+from tokenizer import TokenType
+
+
+class Opcode(enum.IntEnum):
+    """
+    An instruction of the bytecode virtual machine (see vm.py).
+    Every opcode takes one byte and is followed by its operands, whose sizes in
+    bytes are listed in OPERAND_WIDTHS. Multi-byte operands are little endian.
+    """
+    LOAD_CONST = 0      # push consts[i]
+    LOAD_NAME = 1       # push the value of names[i]
+    STORE_NAME = 2      # pop a value and assign it to names[i]
+    POP_TOP = 3         # pop a value and discard it
+    BINARY_OP = 4       # pop b, pop a, push the operator (a TokenType) on a, b
+    UNARY_OP = 5        # pop a, push the operator (a TokenType) on a
+    LOAD_FUNC = 6       # push the Function named names[i]
+    CALL = 7            # call the Function below nargs arguments, named names[i]
+    CALL_BUILTIN = 8    # call the Python callable consts[i] with nargs arguments
+    RETURN_VALUE = 9    # pop a value and return it from the current function
+    JUMP = 10           # continue at target
+    JUMP_IF_FALSE = 11  # pop a value and continue at target if it is falsy
+    ENTER_SCOPE = 12    # continue in a new environment within the current one
+    EXIT_SCOPE = 13     # continue in the parent of the current environment
+    EVAL_NODE = 14      # push consts[i].evaluate(env), for trees without bytecode
+    # Same as BINARY_OP on the operator, but faster if both operands are int or
+    # float (emitted when one of them is known to be)
+    ADD_NUMBER = 15
+    SUBTRACT_NUMBER = 16
+    MULTIPLY_NUMBER = 17
+    LESS_THAN_NUMBER = 18
+    LESS_EQUAL_NUMBER = 19
+    GREATER_THAN_NUMBER = 20
+    GREATER_EQUAL_NUMBER = 21
+    # The operand of the next instruction (one of EXTENDED_OPCODES) is
+    # hi << 16 | its own operand
+    EXTENDED_ARG = 22
+
+
+# dict[Opcode, tuple[int, ...]]
+# [opcode, [width of each operand in bytes]]
+OPERAND_WIDTHS = \
+{
+    Opcode.LOAD_CONST: (2,),
+    Opcode.LOAD_NAME: (2,),
+    Opcode.STORE_NAME: (2,),
+    Opcode.POP_TOP: (),
+    Opcode.BINARY_OP: (1,),
+    Opcode.UNARY_OP: (1,),
+    Opcode.LOAD_FUNC: (2,),
+    Opcode.CALL: (1, 2),
+    Opcode.CALL_BUILTIN: (1, 2),
+    Opcode.RETURN_VALUE: (),
+    Opcode.JUMP: (2,),
+    Opcode.JUMP_IF_FALSE: (2,),
+    Opcode.ENTER_SCOPE: (),
+    Opcode.EXIT_SCOPE: (),
+    Opcode.EVAL_NODE: (2,),
+    Opcode.ADD_NUMBER: (),
+    Opcode.SUBTRACT_NUMBER: (),
+    Opcode.MULTIPLY_NUMBER: (),
+    Opcode.LESS_THAN_NUMBER: (),
+    Opcode.LESS_EQUAL_NUMBER: (),
+    Opcode.GREATER_THAN_NUMBER: (),
+    Opcode.GREATER_EQUAL_NUMBER: (),
+    Opcode.EXTENDED_ARG: (2,),
+}
+
+# The largest value of a two-byte operand
+MAX_OPERAND = 0xFFFF
+
+# frozenset[Opcode]
+# The opcodes which may follow EXTENDED_ARG. Names, functions and arguments
+# beyond the two-byte range are left to the tree instead (see Compiler)
+EXTENDED_OPCODES = frozenset({Opcode.LOAD_CONST, Opcode.EVAL_NODE, Opcode.JUMP,
+                              Opcode.JUMP_IF_FALSE})
+
+
+# dict[TokenType, Opcode]
+# [operator, opcode specialized for numeric operands]
+NUMBER_OPCODES = \
+{
+    TokenType.ADD: Opcode.ADD_NUMBER,
+    TokenType.SUBTRACT: Opcode.SUBTRACT_NUMBER,
+    TokenType.MULTIPLY: Opcode.MULTIPLY_NUMBER,
+    TokenType.LESS_THAN: Opcode.LESS_THAN_NUMBER,
+    TokenType.LESS_EQUAL: Opcode.LESS_EQUAL_NUMBER,
+    TokenType.GREATER_THAN: Opcode.GREATER_THAN_NUMBER,
+    TokenType.GREATER_EQUAL: Opcode.GREATER_EQUAL_NUMBER,
+}
+
+
+# frozenset[TokenType]
+# The operators which compile_operation leaves to the tree, unless they are a
+# plain assignment (see assignment_target)
+FALLBACK_OPERATORS = frozenset({TokenType.ASSIGN, TokenType.RETURN})
+
+
+class Chunk:
+    """
+    The bytecode of a program or of a function.
+
+    code: the opcodes and their operands
+    consts: the values referred to by LOAD_CONST, CALL_BUILTIN and EVAL_NODE
+    names: the names referred to by LOAD_NAME, STORE_NAME, LOAD_FUNC and CALL
+    statements: the offsets in code at which each top-level statement starts
+    """
+    code: bytearray
+    consts: list[Any]
+    names: list[str]
+    statements: list[int]
+
+    def __init__(self, code: bytearray, consts: list[Any], names: list[str],
+                 statements: list[int]):
+        self.code = code
+        self.consts = consts
+        self.names = names
+        self.statements = statements
+
+    def __repr__(self) -> str:
+        return f"Chunk<{len(self.code)} bytes, {len(self.consts)} constants, " \
+               f"{len(self.names)} names>"
+
+    def disassemble(self) -> list[str]:
+        """
+        Return a readable line for each instruction in code.
+
+        >>> compile_program([Operation(Constant(Name('x')), TokenType.ASSIGN, \
+                Operation(Name('y'), TokenType.ADD, Constant(1)))]).disassemble()
+        ['0 LOAD_NAME 0', '3 LOAD_CONST 0', '6 ADD_NUMBER', '7 STORE_NAME 1']
+        """
+        lines = []
+        pc = 0
+        while pc < len(self.code):
+            op = Opcode(self.code[pc])
+            operands = []
+            offset = pc + 1
+            for width in OPERAND_WIDTHS[op]:
+                operands.append(int.from_bytes(self.code[offset:offset + width],
+                                               "little"))
+                offset += width
+            if op == Opcode.BINARY_OP or op == Opcode.UNARY_OP:
+                operands = [TokenType(operands[0]).name]
+            lines.append(" ".join([str(pc), op.name] + [str(o) for o in operands]))
+            pc = offset
+        return lines
+
+
+class Compiler:
+    """
+    Compile expression trees into bytecode.
+
+    Every expression compiled by compile_expression leaves exactly one value on
+    the stack. Statements (compile_statement) leave the stack as it was, but
+    return from the current function when the tree would have produced a
+    RetVal.
+    """
+    code: bytearray
+    consts: list[Any]
+    const_indices: dict[tuple[type, Any], int]
+    names: list[str]
+    name_indices: dict[str, int]
+    statements: list[int]
+    wide_jumps: bool
+
+    def __init__(self, wide_jumps: bool = False) -> None:
+        """
+        Initialize an empty chunk. If <wide_jumps>, every forward jump gets
+        an EXTENDED_ARG, so that it can reach past MAX_OPERAND.
+        """
+        self.wide_jumps = wide_jumps
+        self.code = bytearray()
+        self.consts = []
+        self.const_indices = {}
+        self.names = []
+        self.name_indices = {}
+        self.statements = []
+
+    def chunk(self) -> Chunk:
+        """
+        Return everything compiled so far as a Chunk.
+        """
+        return Chunk(self.code, self.consts, self.names, self.statements)
+
+    def emit(self, op: Opcode, *operands: int) -> int:
+        """
+        Append an instruction and return the offset of its first operand.
+        An operand of one of EXTENDED_OPCODES which is too large for two bytes
+        is split with an EXTENDED_ARG.
+        """
+        if op in EXTENDED_OPCODES and operands[0] > MAX_OPERAND:
+            self.emit(Opcode.EXTENDED_ARG, operands[0] >> 16)
+            operands = (operands[0] & MAX_OPERAND,)
+        self.code.append(op)
+        start = len(self.code)
+        for (width, operand) in zip(OPERAND_WIDTHS[op], operands):
+            if operand >= 1 << (8 * width):
+                raise OverflowError(f"Operand {operand} of {op.name} does not fit "
+                                    f"in {width} bytes.")
+            self.code += operand.to_bytes(width, "little")
+        return start
+
+    def emit_jump(self, op: Opcode) -> int:
+        """
+        Append a forward jump whose target is set later by patch, and return
+        the offset of its operand.
+        """
+        if self.wide_jumps:
+            self.emit(Opcode.EXTENDED_ARG, 0)
+        return self.emit(op, 0)
+
+    def patch(self, offset: int) -> None:
+        """
+        Make the jump operand at <offset> point to the end of the code.
+
+        Throws if:
+            - the end is beyond MAX_OPERAND, and the jump has no EXTENDED_ARG
+        """
+        target = len(self.code)
+        if target > MAX_OPERAND:
+            if not self.wide_jumps:
+                raise OverflowError("Chunk is too large for a jump.")
+            self.code[offset - 3:offset - 1] = (target >> 16).to_bytes(2, "little")
+        self.code[offset:offset + 2] = (target & MAX_OPERAND).to_bytes(2, "little")
+
+    def const_index(self, value: Any) -> int:
+        """
+        Return the index of <value> in the constants, adding it if necessary.
+        Equal values of different types (e.g. 1 and 1.0), and 0.0 and -0.0,
+        are kept apart.
+
+        >>> compiler = Compiler()
+        >>> [compiler.const_index(v) for v in (1, 1.0, 1, None, True, None)]
+        [0, 1, 0, 2, 3, 2]
+        >>> [compiler.const_index(v) for v in (0.0, -0.0, 0.0)]
+        [4, 5, 4]
+        """
+        if type(value) is float:
+            key = (float, math.copysign(1.0, value), value)
+        else:
+            key = (type(value), value)
+        try:
+            index = self.const_indices.get(key)
+        except TypeError:
+            # Unhashable values are never shared
+            self.consts.append(value)
+            return len(self.consts) - 1
+        if index is None:
+            index = self.const_indices[key] = len(self.consts)
+            self.consts.append(value)
+        return index
+
+    def name_index(self, name: str) -> int:
+        """
+        Return the index of <name> in the names, adding it if necessary.
+        """
+        index = self.name_indices.get(name)
+        if index is None:
+            index = self.name_indices[name] = len(self.names)
+            self.names.append(name)
+        return index
+
+    def is_short_name(self, name: str) -> bool:
+        """
+        Return whether the index which <name> has, or would get, fits in two
+        bytes.
+        """
+        return self.name_indices.get(name, len(self.names)) <= MAX_OPERAND
+
+    def compile_fallback(self, expr: Expression) -> None:
+        """
+        Push the value of a tree which has no bytecode equivalent by evaluating
+        it directly.
+        """
+        self.emit(Opcode.EVAL_NODE, self.const_index(expr))
+
+    def compile_expression(self, expr: Expression) -> None:
+        """
+        Compile <expr> so that its value is pushed onto the stack.
+        """
+        if isinstance(expr, Constant):
+            self.emit(Opcode.LOAD_CONST, self.const_index(expr.value))
+        elif isinstance(expr, Name):
+            name = self.name_index(expr.name)
+            if name > MAX_OPERAND:
+                self.compile_fallback(expr)
+            else:
+                self.emit(Opcode.LOAD_NAME, name)
+        elif isinstance(expr, Operation):
+            self.compile_operation(expr)
+        elif isinstance(expr, Invocation):
+            self.compile_invocation(expr)
+        else:
+            self.compile_fallback(expr)
+
+    def compile_operation(self, expr: Operation) -> None:
+        """
+        Compile an operation whose value is used.
+        """
+        target = assignment_target(expr)
+        if target is not None and self.is_short_name(target):
+            self.compile_expression(expr.r_operand)
+            self.emit(Opcode.STORE_NAME, self.name_index(target))
+            self.emit(Opcode.LOAD_CONST, self.const_index(None))
+        elif expr.operator in FALLBACK_OPERATORS \
+            or (expr._has_left and expr.l_operand is None) \
+            or (expr._has_right and expr.r_operand is None):
+            # Invalid or producing a RetVal, leave the details to the tree
+            self.compile_fallback(expr)
+        elif expr._has_left:
+            self.compile_expression(expr.l_operand)
+            self.compile_expression(expr.r_operand)
+            specialized = NUMBER_OPCODES.get(expr.operator)
+            if specialized is not None and (is_number(expr.l_operand)
+                                            or is_number(expr.r_operand)):
+                self.emit(specialized)
+            else:
+                self.emit(Opcode.BINARY_OP, expr.operator)
+        else:
+            self.compile_expression(expr.r_operand)
+            self.emit(Opcode.UNARY_OP, expr.operator)
+
+    def compile_invocation(self, expr: Invocation) -> None:
+        """
+        Compile a function call whose value is used.
+        """
+        name = self.name_index(expr.func)
+        if name > MAX_OPERAND or len(expr.args) > 0xFF:
+            self.compile_fallback(expr)
+            return
+        if expr._func_obj is not None:
+            self.emit(Opcode.LOAD_CONST, self.const_index(expr._func_obj))
+        else:
+            self.emit(Opcode.LOAD_FUNC, name)
+        for arg in expr.args:
+            self.compile_expression(arg)
+        self.emit(Opcode.CALL, len(expr.args), name)
+
+    def compile_statement(self, expr: Optional[Expression]) -> None:
+        """
+        Compile <expr> so that its value is discarded, unless it is a returned
+        value.
+        """
+        if expr is None or type(expr) is Constant:
+            # A literal on its own has no effect
+            return
+        if isinstance(expr, Operation):
+            target = assignment_target(expr)
+            if target is not None and self.is_short_name(target):
+                self.compile_expression(expr.r_operand)
+                self.emit(Opcode.STORE_NAME, self.name_index(target))
+                return
+            if expr.operator == TokenType.RETURN and expr.r_operand is not None:
+                self.compile_expression(expr.r_operand)
+                self.emit(Opcode.RETURN_VALUE)
+                return
+        elif isinstance(expr, Block):
+            for step in expr.steps:
+                self.compile_statement(step)
+            return
+        elif isinstance(expr, IfBlock):
+            self.compile_if(expr)
+            return
+        elif isinstance(expr, WhileLoop):
+            self.compile_while(expr)
+            return
+        elif isinstance(expr, ForLoop):
+            self.compile_for(expr)
+            return
+        elif isinstance(expr, Builtin):
+            # A builtin always results in a RetVal
+            for arg in expr.args:
+                self.compile_expression(arg)
+            self.emit(Opcode.CALL_BUILTIN, len(expr.args),
+                      self.const_index(expr.func))
+            self.emit(Opcode.RETURN_VALUE)
+            return
+        self.compile_expression(expr)
+        self.emit(Opcode.POP_TOP)
+
+    def compile_if(self, expr: IfBlock) -> None:
+        """
+        Compile an if block: each condition is tested in turn, and only the
+        code of the first true one is executed in its own scope.
+        """
+        end_jumps = []
+        for (cond, code) in expr.steps:
+            skip = None
+            if not (isinstance(cond, Constant) and cond.value is True):
+                self.compile_expression(cond)
+                skip = self.emit_jump(Opcode.JUMP_IF_FALSE)
+            self.emit(Opcode.ENTER_SCOPE)
+            self.compile_statement(code)
+            self.emit(Opcode.EXIT_SCOPE)
+            if skip is None:
+                break
+            end_jumps.append(self.emit_jump(Opcode.JUMP))
+            self.patch(skip)
+        for jump in end_jumps:
+            self.patch(jump)
+
+    def compile_while(self, expr: WhileLoop) -> None:
+        """
+        Compile a while loop, which executes its code in a new scope on every
+        iteration.
+        """
+        start = len(self.code)
+        skip = None
+        if expr.cond is not None:
+            self.compile_expression(expr.cond)
+            skip = self.emit_jump(Opcode.JUMP_IF_FALSE)
+        if expr.code is not None:
+            self.emit(Opcode.ENTER_SCOPE)
+            self.compile_statement(expr.code)
+            self.emit(Opcode.EXIT_SCOPE)
+        self.emit(Opcode.JUMP, start)
+        if skip is not None:
+            self.patch(skip)
+
+    def compile_for(self, expr: ForLoop) -> None:
+        """
+        Compile a for loop, which executes entirely within one new scope.
+        """
+        self.emit(Opcode.ENTER_SCOPE)
+        self.compile_statement(expr.first)
+        start = len(self.code)
+        skip = None
+        if expr.cond is not None:
+            self.compile_expression(expr.cond)
+            skip = self.emit_jump(Opcode.JUMP_IF_FALSE)
+        self.compile_statement(expr.code)
+        self.compile_statement(expr.on_rpt)
+        self.emit(Opcode.JUMP, start)
+        if skip is not None:
+            self.patch(skip)
+        self.emit(Opcode.EXIT_SCOPE)
+
+
+def is_number(expr: Expression) -> bool:
+    """
+    Return whether <expr> is known to evaluate to an int or a float.
+
+    >>> is_number(Operation(Constant(1.5), TokenType.MULTIPLY, Constant(2)))
+    True
+    >>> is_number(Operation(Constant(1), TokenType.ADD, Name('x')))
+    False
+    >>> is_number(Constant(True))
+    False
+    """
+    if type(expr) is Constant:
+        return type(expr.value) is int or type(expr.value) is float
+    if isinstance(expr, Operation) and expr.operator in (TokenType.ADD,
+            TokenType.SUBTRACT, TokenType.MULTIPLY):
+        return is_number(expr.l_operand) and is_number(expr.r_operand)
+    return False
+
+
+def assignment_target(expr: Operation) -> Optional[str]:
+    """
+    Return the name assigned to by <expr> if it is a plain assignment which
+    can be compiled to STORE_NAME, or None otherwise.
+    """
+    if expr.operator == TokenType.ASSIGN and expr.r_operand is not None \
+        and isinstance(expr.l_operand, Constant) \
+        and isinstance(expr.l_operand.value, Name):
+        return expr.l_operand.value.name
+    return None
+
+
+def compile_chunk(compile_code: Callable[[Compiler], None]) -> Chunk:
+    """
+    Return the Chunk which <compile_code> compiles with a fresh Compiler. If
+    a forward jump can not reach its target, the code is compiled again with
+    wide jumps; chunks small enough for two-byte jumps are not slowed down by
+    their EXTENDED_ARGs.
+
+    >>> chunk = compile_chunk(lambda compiler: compiler.compile_statement( \
+            WhileLoop(Name('x'), Block([Name('y')] * 0x6000))))
+    >>> chunk.disassemble()[:3]
+    ['0 LOAD_NAME 0', '3 EXTENDED_ARG 1', '6 JUMP_IF_FALSE 32782']
+    >>> chunk.disassemble()[-1], len(chunk.code) == 1 << 16 | 32782
+    ('98315 JUMP 0', True)
+    """
+    compiler = Compiler()
+    try:
+        compile_code(compiler)
+    except OverflowError:
+        compiler = Compiler(wide_jumps=True)
+        compile_code(compiler)
+    return compiler.chunk()
+
+
+def compile_program(expressions: list[Expression]) -> Chunk:
+    """
+    Compile the top-level statements of a program into a single Chunk.
+
+    >>> chunk = compile_program([ \
+            Operation(Constant(Name('i')), TokenType.ASSIGN, Constant(0)), \
+            WhileLoop(Operation(Name('i'), TokenType.LESS_THAN, Constant(3)), \
+                Block([Operation(Constant(Name('i')), TokenType.ASSIGN, \
+                    Operation(Name('i'), TokenType.ADD, Constant(1)))]))])
+    >>> for line in chunk.disassemble(): print(line)
+    0 LOAD_CONST 0
+    3 STORE_NAME 0
+    6 LOAD_NAME 0
+    9 LOAD_CONST 1
+    12 LESS_THAN_NUMBER
+    13 JUMP_IF_FALSE 31
+    16 ENTER_SCOPE
+    17 LOAD_NAME 0
+    20 LOAD_CONST 2
+    23 ADD_NUMBER
+    24 STORE_NAME 0
+    27 EXIT_SCOPE
+    28 JUMP 6
+    >>> chunk.statements
+    [0, 6]
+    >>> compile_program([Constant(1), Invocation('f', [])]).disassemble()
+    ['0 LOAD_FUNC 0', '3 CALL 0 0', '7 POP_TOP']
+    """
+    def compile_statements(compiler: Compiler) -> None:
+        for expr in expressions:
+            compiler.statements.append(len(compiler.code))
+            compiler.compile_statement(expr)
+
+    return compile_chunk(compile_statements)
+
+
+def compile_function(func: Function) -> Chunk:
+    """
+    Compile the code of <func> into a Chunk which returns None unless the code
+    returns a value itself.
+
+    >>> for line in compile_function(Function(['x'], \
+            Builtin(print, [Name('x')]))).disassemble(): print(line)
+    0 LOAD_NAME 0
+    3 CALL_BUILTIN 1 0
+    7 RETURN_VALUE
+    8 LOAD_CONST 1
+    11 RETURN_VALUE
+    """
+    def compile_body(compiler: Compiler) -> None:
+        compiler.compile_statement(func.code)
+        compiler.emit(Opcode.LOAD_CONST, compiler.const_index(None))
+        compiler.emit(Opcode.RETURN_VALUE)
+
+    return compile_chunk(compile_body)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
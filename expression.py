@@ -1,17 +1,22 @@
+import math
 from typing import Any, Callable, Optional, Union
 from tokenizer import TokenType
 
 
-class Error:
+class PainError(Exception):
     """
-    A traceback of errors.
+    Raised by an expression which fails to evaluate, and propagated through
+    every enclosing expression until it is caught by Expression.run or the VM.
 
-    traceback: A list of errors, where the first item represents the origin of
-        the error, and each subsequent error is one level higher.
+    traceback: A list of (line, message) errors, where the first item
+        represents the origin of the error, and each subsequent error is one
+        level higher. line is -1 if unknown. The lines are only formatted when
+        the traceback is printed.
     """
-    traceback: list[str]
+    traceback: list[tuple[int, str]]
 
     def __init__(self, message: str = "", origin: int = -1):
+        Exception.__init__(self, message)
         self.traceback = []
         if len(message) != 0:
             self.append(message, origin)
@@ -22,7 +27,7 @@ class Error:
         with the same number of spaces as the level of the error in the
         expression tree.
 
-        >>> e = Error("Ammo Gus")
+        >>> e = PainError("Ammo Gus")
         >>> e.append("", 0)
         >>> e.append("", 1)
         >>> e.append("")
@@ -35,11 +40,14 @@ class Error:
                Ammo Gus
         """
         out = ["Traceback:"]
+        # Every line is indented by a prefix of the same string
+        spaces = ' ' * (len(self.traceback) + 4)
         indent = 4
-        for i in range(1, len(self.traceback) + 1):
-            msg = self.traceback[-i]
+        for (origin, msg) in reversed(self.traceback):
+            if origin >= 0:
+                msg = f"Line {origin}: {msg}" if len(msg) != 0 else f"Line {origin}"
             if len(msg) != 0:
-                out.append(f"{' ' * indent}{msg}")
+                out.append(spaces[:indent] + msg)
                 indent += 1
         return '\n'.join(out)
 
@@ -48,7 +56,7 @@ class Error:
         Append an error to the traceback. If origin >= 0, include a line
         indicator at the start of the message.
 
-        >>> e = Error()
+        >>> e = PainError()
         >>> e.append("hi", 0)
         >>> e.append("", 1)
         >>> e.append("yo", -1)
@@ -58,13 +66,29 @@ class Error:
              Line 1
               Line 0: hi
         """
-        if origin < 0:
-            self.traceback.append(message)
-        else:
-            if len(message) != 0:
-                self.traceback.append(f"Line {origin}: {message}")
-            else:
-                self.traceback.append(f"Line {origin}")
+        self.traceback.append((origin, message))
+
+    def propagate(self, origin: int):
+        """
+        Record that this error passed through an expression on line <origin>.
+        Expressions which were not created from a line (origin < 0) would only
+        add an empty, never printed entry, so nothing is recorded for them.
+
+        >>> e = PainError("hi", 0)
+        >>> e.propagate(-1)
+        >>> e.propagate(2)
+        >>> e
+        Traceback:
+            Line 2
+             Line 0: hi
+        """
+        if origin >= 0:
+            self.traceback.append((origin, ""))
+
+
+# object
+# Stands in for the value of a name which is not defined, since None is a value
+UNDEFINED = object()
 
 
 class Environment:
@@ -74,6 +98,7 @@ class Environment:
     """
     parent_env: 'Environment'
     local_vars: dict[str, Any]
+    __slots__ = ('parent_env', 'local_vars')
 
     def __init__(self, local_vars: dict[str, any], parent_env: 'Environment' = None):
         self.local_vars = local_vars
@@ -82,7 +107,7 @@ class Environment:
     def get_value(self, name: str) -> Any:
         """
         Searches for <name> in <local_vars>. If not found, it then searches
-        the parent environment recursively.
+        the parent environments in turn.
         If <name> is located somewhere, its associated value is returned.
 
         Throws if:
@@ -96,21 +121,27 @@ class Environment:
         1
         >>> env2.get_value('c')
         3
-        >>> env1.get_value('c')
+        >>> try:
+        ...     env1.get_value('c')
+        ... except PainError as e:
+        ...     e
         Traceback:
             Name 'c' is not defined.
         """
-        if name in self.local_vars:
-            return self.local_vars[name]
-        elif self.parent_env is not None:
-            return self.parent_env.get_value(name)
-        return Error(f"Name \'{name}\' is not defined.")
+        scope = self
+        while scope is not None:
+            value = scope.local_vars.get(name, UNDEFINED)
+            if value is not UNDEFINED:
+                return value
+            scope = scope.parent_env
+        raise PainError(f"Name \'{name}\' is not defined.")
     
-    def get_dict_of(self, name: str) -> dict[str, Any]:
+    def get_dict_of(self, name: str) -> Optional[dict[str, Any]]:
         """
         Searches for <name> in <local_vars>. If not found, it then searches
-        the parent environment recursively.
-        If <name> is located somewhere, its containing dictionary is returned.
+        the parent environments in turn.
+        If <name> is located somewhere, its containing dictionary is returned,
+        otherwise None is returned.
 
         >>> env1 = Environment({'a': 1, 'b': 2})
         >>> env2 = Environment({'c': 3}, env1)
@@ -120,272 +151,236 @@ class Environment:
         {'a': 1, 'b': 2}
         >>> env2.get_dict_of('c')
         {'c': 3}
-        >>> env1.get_dict_of('c')
-        Traceback:
-            Name 'c' is not defined.
+        >>> env1.get_dict_of('c') is None
+        True
         """
-        if name in self.local_vars:
-            return self.local_vars
-        elif self.parent_env is not None:
-            return self.parent_env.get_dict_of(name)
-        return Error(f"Name \'{name}\' is not defined.")
+        scope = self
+        while scope is not None:
+            if name in scope.local_vars:
+                return scope.local_vars
+            scope = scope.parent_env
+        return None
 
 
 class Operators:
-    def add(args: list[Union[int, float]],
-            env: Environment) -> Union[int, float, Error]:
+    def add(lhs: Union[int, float], rhs: Union[int, float],
+            env: Environment) -> Union[int, float]:
         """
-        Add two arguments in <args> and return their sum. <env> is ignored.
+        Add <lhs> and <rhs> and return their sum. <env> is ignored.
 
         Throws if:
-            - <args> does not have exactly 2 objects
-            - objects in <args> may not be added
+            - <lhs> and <rhs> may not be added
         """
-        if len(args) != 2:
-            return Error("ADD operator requires exactly 2 operands.")
         try:
-            return args[0] + args[1]
+            return lhs + rhs
         except TypeError as te:
-            return Error(str(te))
+            raise PainError(str(te))
 
-    def sub(args: list[Union[int, float]],
-            env: Environment) -> Union[int, float, Error]:
+    def sub(lhs: Union[int, float], rhs: Union[int, float],
+            env: Environment) -> Union[int, float]:
         """
-        Subtract two arguments in <args> (args[0] - args[1]) and return their
-        difference. <env> is ignored.
+        Subtract <rhs> from <lhs> (lhs - rhs) and return their difference.
+        <env> is ignored.
 
         Throws if:
-            - <args> does not have exactly 2 objects
-            - objects in <args> may not be subtracted
+            - <lhs> and <rhs> may not be subtracted
         """
-        if len(args) != 2:
-            return Error("SUB operator requires exactly 2 operands.")
         try:
-            return args[0] - args[1]
+            return lhs - rhs
         except TypeError as te:
-            return Error(str(te))
+            raise PainError(str(te))
 
-    def mul(args: list[Union[int, float]],
-            env: Environment) -> Union[int, float, Error]:
+    def mul(lhs: Union[int, float], rhs: Union[int, float],
+            env: Environment) -> Union[int, float]:
         """
-        Multiply two arguments in <args> and return their product. <env> is ignored.
+        Multiply <lhs> and <rhs> and return their product. <env> is ignored.
 
         Throws if:
-            - <args> does not have exactly 2 objects
-            - objects in <args> may not be multiplied
+            - <lhs> and <rhs> may not be multiplied
         """
-        if len(args) != 2:
-            return Error("MUL operator requires exactly 2 operands.")
         try:
-            return args[0] * args[1]
+            return lhs * rhs
         except TypeError as te:
-            return Error(str(te))
+            raise PainError(str(te))
     
-    def mod(args: list[Any], env: Environment) -> Any:
+    def mod(lhs: Any, rhs: Any, env: Environment) -> Any:
         """
-        Divide two arguments in <args> (args[0] / args[1]) and return their
-        remainder. <env> is ignored.
+        Divide <lhs> by <rhs> (lhs / rhs) and return the remainder.
+        <env> is ignored.
 
         Throws if:
-            - <args> does not have exactly 2 objects
-            - objects in <args> may not be divided with remainder
-            - args[1] is zero
+            - <lhs> and <rhs> may not be divided with remainder
+            - <rhs> is zero
         """
-        if len(args) != 2:
-            return Error("MOD operator requires exactly 2 operands.")
         try:
-            return args[0] % args[1]
+            return lhs % rhs
         except TypeError as te:
-            return Error(str(te))
+            raise PainError(str(te))
         except ZeroDivisionError as zde:
-            return Error(str(zde))
+            raise PainError(str(zde))
 
-    def div(args: list[Union[int, float]],
-            env: Environment) -> Union[int, float, Error]:
+    def div(lhs: Union[int, float], rhs: Union[int, float],
+            env: Environment) -> Union[int, float]:
         """
-        Divide two arguments in <args> (args[0] / args[1]) and return their
-        quotient. <env> is ignored.
+        Divide <lhs> by <rhs> (lhs / rhs) and return their quotient.
+        <env> is ignored.
 
         Throws if:
-            - <args> does not have exactly 2 objects
-            - objects in <args> may not be divided
-            - args[1] is zero
+            - <lhs> and <rhs> may not be divided
+            - <rhs> is zero
         """
-        if len(args) != 2:
-            return Error("DIV operator requires exactly 2 operands.")
         try:
-            return args[0] / args[1]
+            return lhs / rhs
         except TypeError as te:
-            return Error(str(te))
+            raise PainError(str(te))
         except ZeroDivisionError as zde:
-            return Error(str(zde))
+            raise PainError(str(zde))
     
-    def eql(args: list[Any], env: Environment) -> bool:
+    def eql(lhs: Any, rhs: Any, env: Environment) -> bool:
         """
-        Compare two arguments in <args> (args[0] == args[1]) and return True iff
-        args[0] == args[1]. <env> is ignored.
+        Return True iff lhs == rhs. <env> is ignored.
 
         Throws if:
-            - <args> does not have exactly 2 objects
-            - objects in <args> may not be compared
+            - <lhs> and <rhs> may not be compared
         """
-        if len(args) != 2:
-            return Error("EQL operator requires exactly 2 operands.")
         try:
-            return args[0] == args[1]
+            return lhs == rhs
         except TypeError as te:
-            return Error(str(te))
+            raise PainError(str(te))
 
-    def grt(args: list[Any], env: Environment) -> bool:
+    def grt(lhs: Any, rhs: Any, env: Environment) -> bool:
         """
-        Compare two arguments in <args> (args[0] > args[1]) and return True iff
-        args[0] > args[1]. <env> is ignored.
+        Return True iff lhs > rhs. <env> is ignored.
 
         Throws if:
-            - <args> does not have exactly 2 objects
-            - objects in <args> may not be compared
+            - <lhs> and <rhs> may not be compared
         """
-        if len(args) != 2:
-            return Error("GRT operator requires exactly 2 operands.")
         try:
-            return args[0] > args[1]
+            return lhs > rhs
         except TypeError as te:
-            return Error(str(te))
+            raise PainError(str(te))
 
-    def geq(args: list[Any], env: Environment) -> bool:
+    def geq(lhs: Any, rhs: Any, env: Environment) -> bool:
         """
-        Compare two arguments in <args> (args[0] >= args[1]) and return True iff
-        args[0] >= args[1].
+        Return True iff lhs >= rhs. <env> is ignored.
 
         Throws if:
-            - <args> does not have exactly 2 objects
-            - objects in <args> may not be compared
+            - <lhs> and <rhs> may not be compared
         """
-        if len(args) != 2:
-            return Error("GEQ operator requires exactly 2 operands.")
         try:
-            return args[0] >= args[1]
+            return lhs >= rhs
         except TypeError as te:
-            return Error(str(te))
+            raise PainError(str(te))
 
-    def les(args: list[Any], env: Environment) -> bool:
+    def les(lhs: Any, rhs: Any, env: Environment) -> bool:
         """
-        Compare two arguments in <args> (args[0] < args[1]) and return True iff
-        args[0] < args[1].
+        Return True iff lhs < rhs. <env> is ignored.
 
         Throws if:
-            - <args> does not have exactly 2 objects
-            - objects in <args> may not be compared
+            - <lhs> and <rhs> may not be compared
         """
-        if len(args) != 2:
-            return Error("LES operator requires exactly 2 operands.")
         try:
-            return args[0] < args[1]
+            return lhs < rhs
         except TypeError as te:
-            return Error(str(te))
+            raise PainError(str(te))
 
-    def leq(args: list[Any], env: Environment) -> bool:
+    def leq(lhs: Any, rhs: Any, env: Environment) -> bool:
         """
-        Compare two arguments in <args> (args[0] <= args[1]) and return True iff
-        args[0] <= args[1].
+        Return True iff lhs <= rhs. <env> is ignored.
 
         Throws if:
-            - <args> does not have exactly 2 objects
-            - objects in <args> may not be compared
+            - <lhs> and <rhs> may not be compared
         """
-        if len(args) != 2:
-            return Error("LEQ operator requires exactly 2 operands.")
         try:
-            return args[0] <= args[1]
+            return lhs <= rhs
         except TypeError as te:
-            return Error(str(te))
+            raise PainError(str(te))
 
-    def ass(args: list[Any], env: Environment) -> Optional[Error]:
+    def ass(lhs: Any, rhs: Any, env: Environment) -> None:
         """
-        Assign args[1] to args[0], using the assign method.
+        Assign <rhs> to <lhs>, using the assign method.
+
+        >>> env = Environment({})
+        >>> Operators.ass(Name('x'), 5, env)
+        >>> env.get_value('x')
+        5
+        >>> Operation(Constant(1), TokenType.ASSIGN, Constant(5)).run(env)
+        Traceback:
+            ASSIGN operator requires assignable left operand.
 
         Throws if:
-            - <args> does not have exactly 2 objects
-            - args[0] is not assignable (doesn't have callable attribute assign)
+            - <lhs> is not assignable (doesn't have callable attribute assign)
         """
-        if len(args) != 2:
-            return Error("ASSIGN operator requires exactly 2 operands.")
-        if not hasattr(args[0], 'assign'):
-            return Error("ASSIGN operator requires assignable left operand.")
-        args[0].assign(args[1], env)
+        try:
+            assign = lhs.assign
+        except AttributeError:
+            # The parser only produces names as targets, so this is rare
+            raise PainError("ASSIGN operator requires assignable left operand.")
+        assign(rhs, env)
 
-    def ret(args: list[Any], env: Environment) -> Union['RetVal', Error]:
+    def ret(value: Any, env: Environment) -> 'RetVal':
         """
-        Return args[0] as a RetVal to signify the termination of a function with a
-        returned value.
+        Return <value> as a RetVal to signify the termination of a function
+        with a returned value.
 
-        Throws if:
-            - <args> does not have exactly 1 object
+        No throw guarantee.
         """
-        if len(args) != 1:
-            return Error("RETURN operator requires exactly 1 operand.")
-        return RetVal(args[0])
+        return RetVal(value)
 
-    def _not(args: list[Any], env: Environment) -> Union[int, Error]:
+    def _not(value: Any, env: Environment) -> bool:
         """
-        Return the negation of args[0].
+        Return the negation of <value>.
         Throws if:
-            - <args> does not have exactly 1 object of type bool
+            - <value> has no truth value
         """
-        if len(args) != 1:
-            return Error("NOT operator requires exactly 1 operand.")
         try:
-            return not bool(args[0])
+            return not bool(value)
         except TypeError as te:
-            return Error(str(te))
+            raise PainError(str(te))
 
-    def _and(args: list[Any], env: Environment) -> Union[int, Error]:
+    def _and(lhs: Any, rhs: Any, env: Environment) -> bool:
         """
-        Return the "and" of args[0] and args[1].
+        Return the "and" of <lhs> and <rhs>.
         Throws if:
-            - <args> does not have exactly 2 objects of type bool
+            - <lhs> or <rhs> has no truth value
         """
-        if len(args) != 2:
-            return Error("AND operator requires exactly 2 operands.")
         try:
-            return bool(args[0]) and bool(args[1])
+            return bool(lhs) and bool(rhs)
         except TypeError as te:
-            return Error(str(te))
+            raise PainError(str(te))
 
-    def _or(args: list[Any], env: Environment) -> Union[int, Error]:
+    def _or(lhs: Any, rhs: Any, env: Environment) -> bool:
         """
-        Return the "or" of args[0] and args[1].
+        Return the "or" of <lhs> and <rhs>.
         Throws if:
-            - <args> does not have exactly 2 objects of type bool
+            - <lhs> or <rhs> has no truth value
         """
-        if len(args) != 2:
-            return Error("OR operator requires exactly 2 operands.")
         try:
-            return bool(args[0]) or bool(args[1])
+            return bool(lhs) or bool(rhs)
         except TypeError as te:
-            return Error(str(te))
-
-
-# dict[str, tuple[bool, bool, Callable]]
-# [id (one char), [has left operand, has right operand, operator function]]
-OPERATORS = \
-{
-    TokenType.ADD: (True, True, Operators.add),
-    TokenType.SUBTRACT: (True, True, Operators.sub),
-    TokenType.MULTIPLY: (True, True, Operators.mul),
-    TokenType.DIVIDE: (True, True, Operators.div),
-    TokenType.MOD: (True, True, Operators.mod),
-    TokenType.EQUAL: (True, True, Operators.eql),
-    TokenType.GREATER_THAN: (True, True, Operators.grt),
-    TokenType.GREATER_EQUAL: (True, True, Operators.geq),
-    TokenType.LESS_THAN: (True, True, Operators.les),
-    TokenType.LESS_EQUAL: (True, True, Operators.leq),
-    TokenType.ASSIGN: (True, True, Operators.ass),
-    TokenType.RETURN: (False, True, Operators.ret),
-    TokenType.NOT: (False, True, Operators._not),
-    TokenType.AND: (True, True, Operators._and),
-    TokenType.OR: (True, True, Operators._or)
-}
+            raise PainError(str(te))
+
+
+# list[Optional[tuple[bool, bool, Callable]]], indexed by TokenType
+# [has left operand, has right operand, operator function], or None for token
+# types which are not operators. The function takes the value of each operand
+# it has, followed by the environment.
+OPERATORS = [None] * (max(TokenType) + 1)
+OPERATORS[TokenType.ADD] = (True, True, Operators.add)
+OPERATORS[TokenType.SUBTRACT] = (True, True, Operators.sub)
+OPERATORS[TokenType.MULTIPLY] = (True, True, Operators.mul)
+OPERATORS[TokenType.DIVIDE] = (True, True, Operators.div)
+OPERATORS[TokenType.MOD] = (True, True, Operators.mod)
+OPERATORS[TokenType.EQUAL] = (True, True, Operators.eql)
+OPERATORS[TokenType.GREATER_THAN] = (True, True, Operators.grt)
+OPERATORS[TokenType.GREATER_EQUAL] = (True, True, Operators.geq)
+OPERATORS[TokenType.LESS_THAN] = (True, True, Operators.les)
+OPERATORS[TokenType.LESS_EQUAL] = (True, True, Operators.leq)
+OPERATORS[TokenType.ASSIGN] = (True, True, Operators.ass)
+OPERATORS[TokenType.RETURN] = (False, True, Operators.ret)
+OPERATORS[TokenType.NOT] = (False, True, Operators._not)
+OPERATORS[TokenType.AND] = (True, True, Operators._and)
+OPERATORS[TokenType.OR] = (True, True, Operators._or)
 
 
 class Expression:
@@ -396,6 +391,7 @@ class Expression:
             (-1 if initialized on its own)
     """
     origin: int
+    __slots__ = ('origin',)
 
     def __init__(self, origin: int = -1):
         self.origin = origin
@@ -403,6 +399,24 @@ class Expression:
     def evaluate(self, env: Environment) -> Any:
         raise NotImplementedError
 
+    def run(self, env: Environment) -> Any:
+        """
+        Evaluate this expression in <env>. If evaluation fails, the PainError
+        describing the failure is returned instead of being raised.
+
+        No throw guarantee.
+
+        >>> Name('x').run(Environment({'x': 5}))
+        5
+        >>> Name('x').run(Environment({}))
+        Traceback:
+            Name 'x' is not defined.
+        """
+        try:
+            return self.evaluate(env)
+        except PainError as e:
+            return e
+
 
 class Constant(Expression):
     """
@@ -411,6 +425,7 @@ class Constant(Expression):
     value: the value
     """
     value: Any
+    __slots__ = ('value',)
     
     def __init__(self, value: Any, origin: int = -1):
         Expression.__init__(self, origin)
@@ -440,6 +455,7 @@ class Name(Expression):
     name: the name
     """
     name: str
+    __slots__ = ('name',)
 
     def __init__(self, name: str, origin: int = -1):
         Expression.__init__(self, origin)
@@ -459,7 +475,7 @@ class Name(Expression):
         5
         """
         tgt_dict = env.get_dict_of(self.name)
-        if isinstance(tgt_dict, Error):
+        if tgt_dict is None:
             tgt_dict = env.local_vars
         tgt_dict[self.name] = value
     
@@ -472,17 +488,18 @@ class Name(Expression):
 
         >>> env = Environment({})
         >>> n = Name("x")
-        >>> n.evaluate(env)
+        >>> n.run(env)
         Traceback:
             Name 'x' is not defined.
         >>> n.assign(5, env)
         >>> n.evaluate(env)
         5
         """
-        val = env.get_value(self.name)
-        if isinstance(val, Error):
-            val.append("", self.origin)
-        return val
+        try:
+            return env.get_value(self.name)
+        except PainError as e:
+            e.propagate(self.origin)
+            raise
 
 
 class Operation(Expression):
@@ -492,20 +509,42 @@ class Operation(Expression):
     l_operand: Expression representing the left operand.
     operator: String representing the operator (must be capital ASCII letter)
     r_operand: Expression representing the right operand.
+    _has_left, _has_right, _func: the entry of operator in OPERATORS
     """
     l_operand: Optional[Expression]
     operator: TokenType
     r_operand: Optional[Expression]
+    _has_left: bool
+    _has_right: bool
+    _func: Callable
+    __slots__ = ('l_operand', 'operator', 'r_operand', '_has_left', '_has_right',
+                 '_func')
 
     def __init__(self, l_operand: Optional[Expression], operator: TokenType,
                  r_operand: Optional[Expression], origin: int = -1):
+        """
+        Throws if:
+            - operator is not an operator
+
+        >>> try:
+        ...     Operation(Constant(1), TokenType.IF, Constant(2))
+        ... except PainError as e:
+        ...     e
+        Traceback:
+            Operator 'TokenType.IF' is invalid.
+        """
         Expression.__init__(self, origin)
+        entry = OPERATORS[operator]
+        if entry is None:
+            raise PainError(f"Operator \'TokenType.{operator.name}\' is invalid.",
+                            origin)
         self.l_operand = l_operand
         self.operator = operator
         self.r_operand = r_operand
+        (self._has_left, self._has_right, self._func) = entry
 
     def __repr__(self) -> str:
-        return f"Operation<{self.l_operand}, {self.operator}, {self.r_operand}>"
+        return f"Operation<{self.l_operand}, TokenType.{self.operator.name}, {self.r_operand}>"
     
     def evaluate(self, env: Environment) -> Any:
         """
@@ -514,7 +553,6 @@ class Operation(Expression):
         of the operator on the operands.
 
         Throws if:
-            - self.operator is undefined
             - a required operand expression is None
             - a required operand expression fails to evaluate
             - the operator fails to evaluate
@@ -524,66 +562,87 @@ class Operation(Expression):
         4
 
         >>> op = Operation(None, TokenType.ADD, Constant(2))
-        >>> op.evaluate(Environment({}))
+        >>> op.run(Environment({}))
         Traceback:
             Missing left operand.
         """
-        if self.operator not in OPERATORS:
-            return Error(f"Operator \'{self.operator}\' is invalid.",
-                         self.origin)
-        operator = OPERATORS[self.operator]
-        args = []
+        has_left = self._has_left
+        has_right = self._has_right
+        if has_left and self.l_operand is None:
+            raise PainError(f"Missing left operand.", self.origin)
+        if has_right and self.r_operand is None:
+            raise PainError(f"Missing right operand.", self.origin)
 
-        if operator[0]: # LEFT OPERAND
-            if self.l_operand is None:
-                return Error(f"Missing left operand.", self.origin)
-            value = self.l_operand.evaluate(env)
-            if isinstance(value, Error):
-                value.append("", self.origin)
-                return value
-            args.append(value)
-        
-        if operator[1]: # RIGHT OPERAND
-            if self.r_operand is None:
-                return Error(f"Missing right operand.", self.origin)
-            value = self.r_operand.evaluate(env)
-            if isinstance(value, Error):
-                value.append("", self.origin)
-                return value
-            args.append(value)
-        
-        result = operator[2](args, env)
-        if isinstance(result, Error):
-            result.append("", self.origin)
-        return result
+        try:
+            if has_left:
+                return self._func(self.l_operand.evaluate(env),
+                                  self.r_operand.evaluate(env), env)
+            return self._func(self.r_operand.evaluate(env), env)
+        except PainError as e:
+            e.propagate(self.origin)
+            raise
 
 
 class RetVal(Constant):
+    __slots__ = ()
     def __repr__(self) -> str:
         return f"RetVal<{self.value}>"
 
 
+class Invalid(Expression):
+    """
+    Expression standing in for one which could not be constructed while
+    parsing, so that the error is only reported once it is evaluated.
+
+    message: the message of the PainError raised by the construction
+    """
+    message: str
+    __slots__ = ('message',)
+
+    def __init__(self, message: str, origin: int = -1):
+        Expression.__init__(self, origin)
+        self.message = message
+
+    def __repr__(self) -> str:
+        return f"Invalid<{self.message}>"
+
+    def evaluate(self, env: Environment) -> Any:
+        """
+        Throws always.
+
+        >>> Invalid("Operator 'TokenType.TO_INT' is invalid.").run(Environment({}))
+        Traceback:
+            Operator 'TokenType.TO_INT' is invalid.
+        """
+        raise PainError(self.message, self.origin)
+
+
 class Block(Expression):
     """
     An executable sequence of expressions.
 
     steps: the sequence of expressions to be executed
     """
-    steps: list[Expression]
+    steps: tuple[Expression, ...]
+    __slots__ = ('steps',)
 
     def __init__(self, steps: list[Expression], origin: int = -1):
-        Expression.__init__(self)
-        self.steps = steps
+        Expression.__init__(self, origin)
+        self.steps = tuple(steps)
 
     def __repr__(self) -> str:
-        return f"Block<{self.steps}>"
+        return f"Block<{list(self.steps)}>"
     
-    def evaluate(self, env: Environment) -> Any:
+    def evaluate(self, env: Environment, _isinstance=isinstance,
+                 _RetVal=RetVal) -> Any:
         """
         Step through expressions in self.steps and evaluate them.
         If any expression evaluates to a RetVal, this result is returned
         immediately and execution halts.
 
+        _isinstance and _RetVal are never passed; binding them as defaults
+        turns the global lookups in the loop into local ones.
+
         Throws if:
             - any step fails to evaluate
         
@@ -595,13 +654,14 @@ class Block(Expression):
         >>> blk.evaluate(env).evaluate(env)
         5
         """
-        for step in self.steps:
-            result = step.evaluate(env)
-            if isinstance(result, Error):
-                result.append("", self.origin)
-                return result
-            elif isinstance(result, RetVal):
-                return result
+        try:
+            for step in self.steps:
+                result = step.evaluate(env)
+                if _isinstance(result, _RetVal):
+                    return result
+        except PainError as e:
+            e.propagate(self.origin)
+            raise
 
 
 class IfBlock(Expression):
@@ -610,15 +670,16 @@ class IfBlock(Expression):
     expression evaluating to True. If it is False, the next condition is
     checked.
     """
-    steps: list[tuple[Expression, Block]]
+    steps: tuple[tuple[Expression, Block], ...]
+    __slots__ = ('steps',)
 
     def __init__(self, steps: list[tuple[Expression, Expression]],
                  origin: int = -1):
         Expression.__init__(self, origin)
-        self.steps = steps
+        self.steps = tuple(steps)
 
     def __repr__(self) -> str:
-        return f"IfBlock<{self.steps}>"
+        return f"IfBlock<{list(self.steps)}>"
     
     def evaluate(self, env: Environment):
         """
@@ -654,21 +715,19 @@ class IfBlock(Expression):
         >>> env.get_value('x')
         3
         """
-        for step in self.steps:
-            cond = step[0].evaluate(env)
-            if isinstance(cond, Error):
-                cond.append("", self.origin)
-                return cond
-            if not isinstance(cond, bool):
-                try:
-                    cond = bool(cond)
-                except TypeError as te:
-                    return Error(str(te))
-            if cond:
-                result = step[1].evaluate(Environment({}, env))
-                if isinstance(result, Error):
-                    result.append("", self.origin)
-                return result
+        try:
+            for step in self.steps:
+                cond = step[0].evaluate(env)
+                if cond is not True and cond is not False:
+                    try:
+                        cond = bool(cond)
+                    except TypeError as te:
+                        raise PainError(str(te))
+                if cond:
+                    return step[1].evaluate(Environment({}, env))
+        except PainError as e:
+            e.propagate(self.origin)
+            raise
 
 
 class WhileLoop(Expression):
@@ -681,6 +740,7 @@ class WhileLoop(Expression):
     """
     cond: Expression
     code: Block
+    __slots__ = ('cond', 'code')
 
     def __init__(self, cond: Expression, code: Block, origin: int = -1):
         Expression.__init__(self, origin)
@@ -716,26 +776,24 @@ class WhileLoop(Expression):
         2
         1
         """
-        while True:
-            if self.cond is not None:
-                cond = self.cond.evaluate(env)
-                if isinstance(cond, Error):
-                    cond.append("", self.origin)
-                    return cond
-                if not isinstance(cond, bool):
-                    try:
-                        cond = bool(cond)
-                    except TypeError as te:
-                        return Error(str(te))
-                if not cond:
-                    break
-            if self.code is not None:
-                result = self.code.evaluate(Environment({}, env))
-                if isinstance(result, Error):
-                    result.append("", self.origin)
-                    return result
-                elif isinstance(result, RetVal):
-                    return result
+        try:
+            while True:
+                if self.cond is not None:
+                    cond = self.cond.evaluate(env)
+                    if cond is not True and cond is not False:
+                        try:
+                            cond = bool(cond)
+                        except TypeError as te:
+                            raise PainError(str(te))
+                    if not cond:
+                        break
+                if self.code is not None:
+                    result = self.code.evaluate(Environment({}, env))
+                    if isinstance(result, RetVal):
+                        return result
+        except PainError as e:
+            e.propagate(self.origin)
+            raise
 
 
 class ForLoop(Expression):
@@ -753,6 +811,7 @@ class ForLoop(Expression):
     cond: Expression
     on_rpt: Expression
     code: Block
+    __slots__ = ('first', 'cond', 'on_rpt', 'code')
 
     def __init__(self, first: Expression, cond: Expression, on_rpt: Expression, 
                  code: Block, origin: int = -1):
@@ -799,75 +858,121 @@ class ForLoop(Expression):
         4
         """
         loop_env = Environment({}, env)
-        if self.first is not None:
-            result = self.first.evaluate(loop_env)
-            if isinstance(result, Error):
-                result.append("", self.origin)
-                return result
-            elif isinstance(result, RetVal):
-                return result
-        while True:
-            if self.cond is not None:
-                cond = self.cond.evaluate(loop_env)
-                if isinstance(cond, Error):
-                    cond.append("", self.origin)
-                    return cond
-                if not isinstance(cond, bool):
-                    try:
-                        cond = bool(cond)
-                    except TypeError as te:
-                        return Error(str(te))
-                if not cond:
-                    break
-            
-            if self.code is not None:
-                result = self.code.evaluate(loop_env)
-                if isinstance(result, Error):
-                    result.append("", self.origin)
-                    return result
-                elif isinstance(result, RetVal):
-                    return result
-            
-            if self.on_rpt is not None:
-                result = self.on_rpt.evaluate(loop_env)
-                if isinstance(result, Error):
-                    result.append("", self.origin)
-                    return result
-                elif isinstance(result, RetVal):
+        try:
+            if self.first is not None:
+                result = self.first.evaluate(loop_env)
+                if isinstance(result, RetVal):
                     return result
+            while True:
+                if self.cond is not None:
+                    cond = self.cond.evaluate(loop_env)
+                    if cond is not True and cond is not False:
+                        try:
+                            cond = bool(cond)
+                        except TypeError as te:
+                            raise PainError(str(te))
+                    if not cond:
+                        break
+                
+                if self.code is not None:
+                    result = self.code.evaluate(loop_env)
+                    if isinstance(result, RetVal):
+                        return result
+                
+                if self.on_rpt is not None:
+                    result = self.on_rpt.evaluate(loop_env)
+                    if isinstance(result, RetVal):
+                        return result
+        except PainError as e:
+            e.propagate(self.origin)
+            raise
+
+
+# int
+# The number of results remembered by each pure Function
+MEMO_SIZE = 1024
+
+
+def memo_key(args: list[Any]) -> tuple:
+    """
+    Return the key under which the result of a call with <args> is cached.
+    The types are part of the key, since e.g. 1 == 1.0 == True, and so are
+    the signs of floats, since 0.0 == -0.0.
+
+    >>> memo_key([1, 'a']) == memo_key([1.0, 'a'])
+    False
+    >>> memo_key([0.0, -1]) == memo_key([-0.0, -1])
+    False
+    """
+    types = tuple(map(type, args))
+    if float in types:
+        return (*args, *types,
+                *[math.copysign(1.0, arg) for arg in args if type(arg) is float])
+    return (*args, *types)
 
 
 class Function(Expression):
     """
     An executable sequence of expressions that may take named parameters and
     may return a value.
+
+    _chunk: the bytecode of code, cached by the compiler module once this
+        function has been called from bytecode (None until then)
+    _pure: whether the result of a call only depends on the arguments, so
+        that it can be remembered in _cache
+    _cache: the results of previous calls, keyed by memo_key of the arguments
+        (only used if _pure)
     """
-    params: list[str]
+    params: tuple[str, ...]
     code: Block
+    _chunk: Any
+    _pure: bool
+    _cache: dict[tuple, Any]
+    __slots__ = ('params', 'code', '_chunk', '_pure', '_cache')
 
     def __init__(self, params: list[str], code: Block,
-                 origin: int = -1):
+                 origin: int = -1, pure: bool = False):
         Expression.__init__(self, origin)
-        self.params = params
+        self.params = tuple(params)
         self.code = code
+        self._chunk = None
+        self._pure = pure
+        self._cache = {}
 
     def __repr__(self) -> str:
-        return f"Function<{self.params}, {self.code}>"
+        return f"Function<{list(self.params)}, {self.code}>"
     
+    def remember(self, key: tuple, value: Any) -> None:
+        """
+        Cache <value> as the result of calling this function with the arguments
+        <key>, forgetting the oldest result if the cache is full.
+
+        >>> f = Function(['x'], Block([]), pure=True)
+        >>> for i in range(MEMO_SIZE + 1):
+        ...     f.remember((i,), i)
+        >>> len(f._cache), (0,) in f._cache
+        (1024, False)
+        """
+        cache = self._cache
+        if len(cache) >= MEMO_SIZE:
+            del cache[next(iter(cache))]
+        cache[key] = value
+
     def evaluate(self, env: Environment) -> Any:
         """
         Function code is evaluated and its value is ignored, unless this value
-        is an Error or RetVal. If a RetVal is encountered, execution is halted
-        and the value is returned.
+        is a RetVal. If a RetVal is encountered, execution is halted and the
+        value is returned.
 
         Throws if:
             - function code fails to evaluate
         """
-        result = self.code.evaluate(Environment({}, env))
-        if isinstance(result, Error):
-            result.append("", self.origin)
-            return result
-        elif isinstance(result, RetVal):
+        try:
+            result = self.code.evaluate(Environment({}, env))
+        except PainError as e:
+            e.propagate(self.origin)
+            raise
+        if isinstance(result, RetVal):
             return result.evaluate(env)
     
 
@@ -876,6 +981,7 @@ class Builtin(Expression):
     """
     func: Callable
     args: list[Expression]
+    __slots__ = ('func', 'args')
 
     def __init__(self, func: Callable, args: list[Expression], origin: int = -1):
         Expression.__init__(self, origin)
@@ -885,34 +991,35 @@ class Builtin(Expression):
     def evaluate(self, env: Environment) -> Any:
         """
         """
-        args = []
-        for arg in self.args:
-            arg = arg.evaluate(env)
-            if isinstance(arg, Error):
-                arg.append("", self.origin)
-                return arg
-            args.append(arg)
+        try:
+            args = [arg.evaluate(env) for arg in self.args]
+        except PainError as e:
+            e.propagate(self.origin)
+            raise
         try:
             result = self.func(*args)
         except Exception as e:
-            return Error(str(e), self.origin)
-        if isinstance(result, Error):
-            result.append("", self.origin)
-            return result
+            raise PainError(str(e), self.origin)
         return RetVal(result)
 
 
 class Invocation(Expression):
     """
-    
+    A call of the function named func with the values of args.
+
+    _func_obj: the Function func is known to refer to (see link), or None if it
+        has to be looked up in the environment on every call
     """
     func: str
     args: list[Expression]
+    _func_obj: Optional[Function]
+    __slots__ = ('func', 'args', '_func_obj')
 
     def __init__(self, func: str, args: list[Expression], origin: int = -1):
         Expression.__init__(self, origin)
         self.args = args
         self.func = func
+        self._func_obj = None
 
     def __repr__(self) -> str:
         return f"Invocation<{self.func}, {self.args}>"
@@ -928,35 +1035,237 @@ class Invocation(Expression):
             - any of self.args fail to evaluate
             - the number of arguments does not match the number of parameters
             required by the function
+
+        >>> calls = []
+        >>> f = Function(['x'], Builtin(lambda x: calls.append(x) or x, \
+                                        [Name('x')]), pure=True)
+        >>> ivk = Invocation('f', [Constant(2)])
+        >>> env = Environment({'f': f})
+        >>> ivk.evaluate(env), ivk.evaluate(env), calls
+        (2, 2, [2])
         """
-        func = env.get_value(self.func)
-        if isinstance(func, Error):
-            func.append("", self.origin)
-            return func
+        func = self._func_obj
+        if func is None:
+            try:
+                func = env.get_value(self.func)
+            except PainError as e:
+                e.propagate(self.origin)
+                raise
         if not isinstance(func, Function):
-            return Error(f"Symbol \'{self.func}\' is not a function.",
-                         self.origin)
+            raise PainError(f"Symbol \'{self.func}\' is not a function.",
+                            self.origin)
         
-        args = []
-        for arg in self.args:
-            arg = arg.evaluate(env)
-            if isinstance(arg, Error):
-                arg.append("", self.origin)
-                return arg
-            args.append(arg)
+        try:
+            args = [arg.evaluate(env) for arg in self.args]
+        except PainError as e:
+            e.propagate(self.origin)
+            raise
         if len(args) != len(func.params):
-            return Error(f"Function \'{self.func}\' requires exactly \
-                           {len(func.params)} parameters.", self.origin)
+            raise PainError(f"Function \'{self.func}\' requires exactly "
+                            f"{len(func.params)} parameters.", self.origin)
+        if func._pure:
+            key = memo_key(args)
+            result = func._cache.get(key, UNDEFINED)
+            if result is not UNDEFINED:
+                return result
         
         sub_env = Environment({}, env)
         for (i, arg) in enumerate(args):
             sub_env.local_vars[func.params[i]] = arg
         
-        result = func.evaluate(sub_env)
-        if isinstance(result, Error):
-            result.append("", self.origin)
+        try:
+            result = func.evaluate(sub_env)
+        except PainError as e:
+            e.propagate(self.origin)
+            raise
+        if func._pure:
+            func.remember(key, result)
         return result
 
+    def rebind(self) -> None:
+        """
+        Forget the Function resolved by link, so that self.func is looked up
+        in the environment again on every call.
+        """
+        self._func_obj = None
+
+
+def iter_tree(expr: Expression):
+    """
+    Yield <expr> and every expression nested within it, including the code of
+    functions held by constants.
+
+    >>> tree = Operation(Constant(Name('x')), TokenType.ASSIGN, \
+                         Invocation('f', [Constant(1)]))
+    >>> list(iter_tree(tree))
+    [Operation<Constant<Name<x>>, TokenType.ASSIGN, Invocation<f, [Constant<1>]>>, Invocation<f, [Constant<1>]>, Constant<1>, Constant<Name<x>>, Name<x>]
+    """
+    stack = [expr]
+    while stack:
+        e = stack.pop()
+        if e is None:
+            continue
+        yield e
+        if isinstance(e, Constant):
+            if isinstance(e.value, Expression):
+                stack.append(e.value)
+        elif isinstance(e, Operation):
+            stack += (e.l_operand, e.r_operand)
+        elif isinstance(e, Block):
+            stack += e.steps
+        elif isinstance(e, IfBlock):
+            for (cond, code) in e.steps:
+                stack += (cond, code)
+        elif isinstance(e, WhileLoop):
+            stack += (e.cond, e.code)
+        elif isinstance(e, ForLoop):
+            stack += (e.first, e.cond, e.on_rpt, e.code)
+        elif isinstance(e, Function):
+            stack.append(e.code)
+        elif isinstance(e, (Builtin, Invocation)):
+            stack += e.args
+
+
+# set[TokenType]
+# Operators whose result only depends on the values of their operands
+PURE_OPERATORS = {
+    TokenType.ADD, TokenType.SUBTRACT, TokenType.MULTIPLY, TokenType.DIVIDE,
+    TokenType.MOD, TokenType.EQUAL, TokenType.GREATER_THAN,
+    TokenType.GREATER_EQUAL, TokenType.LESS_THAN, TokenType.LESS_EQUAL,
+    TokenType.NOT, TokenType.AND, TokenType.OR,
+}
+
+# int
+# The longest string which fold builds by repeating a string literal; longer
+# repetitions are left to run time, as their code may never run
+MAX_FOLDED_LENGTH = 1024
+
+
+def fold(expr: Optional[Expression]) -> Optional[Expression]:
+    """
+    Replace every pure operation in <expr> whose operands are literal values
+    with a Constant holding its result. Nested expressions are folded in place,
+    and the folded <expr> is returned.
+
+    Operations which fail (e.g. dividing by zero), or repeat a string beyond
+    MAX_FOLDED_LENGTH, are kept, so that they still fail or take their time
+    only when they are evaluated.
+
+    >>> fold(Operation(Name('x'), TokenType.ADD, \
+            Operation(Constant(2), TokenType.MULTIPLY, Constant(3))))
+    Operation<Name<x>, TokenType.ADD, Constant<6>>
+    >>> fold(Operation(None, TokenType.NOT, Constant(False)))
+    Constant<True>
+    >>> fold(Operation(Constant(1), TokenType.DIVIDE, Constant(0)))
+    Operation<Constant<1>, TokenType.DIVIDE, Constant<0>>
+    >>> fold(Operation(Constant("ab"), TokenType.MULTIPLY, Constant(2)))
+    Constant<abab>
+    >>> fold(Operation(Constant("ab"), TokenType.MULTIPLY, Constant(3000000000)))
+    Operation<Constant<ab>, TokenType.MULTIPLY, Constant<3000000000>>
+    >>> fold(Operation(Constant("a"), TokenType.MULTIPLY, \
+            Constant(99999999999999999999)))
+    Operation<Constant<a>, TokenType.MULTIPLY, Constant<99999999999999999999>>
+    """
+    if isinstance(expr, Operation):
+        expr.l_operand = fold(expr.l_operand)
+        expr.r_operand = fold(expr.r_operand)
+        if expr.operator not in PURE_OPERATORS:
+            return expr
+        args = []
+        for (needed, operand) in ((expr._has_left, expr.l_operand),
+                                  (expr._has_right, expr.r_operand)):
+            if not needed:
+                continue
+            if type(operand) is not Constant \
+                or not isinstance(operand.value, (bool, int, float, str)):
+                return expr
+            args.append(operand.value)
+        if expr.operator == TokenType.MULTIPLY and str in map(type, args):
+            (text, count) = args if type(args[0]) is str else reversed(args)
+            if type(count) is int and len(text) * count > MAX_FOLDED_LENGTH:
+                return expr
+        try:
+            return Constant(expr._func(*args, None), expr.origin)
+        except Exception:
+            # Any error is reported if and when the operation is evaluated
+            return expr
+    elif isinstance(expr, Constant):
+        if isinstance(expr.value, Function):
+            fold(expr.value)
+    elif isinstance(expr, Block):
+        expr.steps = tuple(fold(step) for step in expr.steps)
+    elif isinstance(expr, IfBlock):
+        expr.steps = tuple((fold(cond), fold(code)) for (cond, code) in expr.steps)
+    elif isinstance(expr, WhileLoop):
+        expr.cond = fold(expr.cond)
+        expr.code = fold(expr.code)
+    elif isinstance(expr, ForLoop):
+        expr.first = fold(expr.first)
+        expr.cond = fold(expr.cond)
+        expr.on_rpt = fold(expr.on_rpt)
+        expr.code = fold(expr.code)
+    elif isinstance(expr, Function):
+        expr.code = fold(expr.code)
+    elif isinstance(expr, (Builtin, Invocation)):
+        expr.args = [fold(arg) for arg in expr.args]
+    return expr
+
+
+def link(expressions: list[Expression], env: Environment) -> None:
+    """
+    Resolve every Invocation in <expressions> (and in the functions already
+    defined in <env>) whose name can only ever refer to the Function it is
+    bound to in <env> now, so that it is not looked up on each call.
+
+    A name can only be rebound by assigning to it, or by using it as a function
+    parameter. Invocations of such names are left to be looked up at runtime.
+
+    Linking can be repeated in a new environment; the bytecode cached by every
+    Function found is discarded, since it may embed the previous links.
+
+    >>> env = Environment({'f': Function(['x'], Block([]))})
+    >>> a, b = Invocation('f', []), Invocation('g', [])
+    >>> assign = Operation(Constant(Name('g')), TokenType.ASSIGN, Constant(1))
+    >>> link([a, b, assign], env)
+    >>> a._func_obj is env.get_value('f'), b._func_obj
+    (True, None)
+    """
+    roots = list(expressions)
+    scope = env
+    while scope is not None:
+        roots += [v for v in scope.local_vars.values() if isinstance(v, Function)]
+        scope = scope.parent_env
+
+    rebindable = set()
+    invocations = []
+    dynamic = False
+    for root in roots:
+        for e in iter_tree(root):
+            if isinstance(e, Operation) and e.operator == TokenType.ASSIGN:
+                if isinstance(e.l_operand, Constant) \
+                    and isinstance(e.l_operand.value, Name):
+                    rebindable.add(e.l_operand.value.name)
+                else:
+                    # The assigned name is only known at runtime
+                    dynamic = True
+            elif isinstance(e, Function):
+                rebindable.update(e.params)
+                # Its bytecode may refer to functions linked previously
+                e._chunk = None
+            elif isinstance(e, Invocation):
+                invocations.append(e)
+
+    for ivk in invocations:
+        ivk.rebind()
+        if dynamic or ivk.func in rebindable:
+            continue
+        try:
+            func = env.get_value(ivk.func)
+        except PainError:
+            continue
+        if isinstance(func, Function):
+            ivk._func_obj = func
+
 if __name__ == "__main__":
     # garbage recursive fibonacci algorithm
     fn_fib = Function(['n'], Block(
@@ -1,19 +1,61 @@
-from expression import Block, Builtin, Expression, Environment, Function, Name
+from compiler import compile_program
+from expression import Block, Builtin, Expression, Environment, Function, Name, PainError, fold, link
 from pain_parser import Parser
+from vm import run
+import os
 import sys
 
 
+# dict[str, tuple[tuple[int, int], list[Expression]]]
+# [file name, [(modification time, size) of the file, its folded expressions]]
+_PROGRAM_CACHE = {}
+
+
 def prepare_environment() -> Environment:
     env = Environment({})
     env.local_vars["print"] = Function(["x"], Builtin(print, [Name("x")]))
-    env.local_vars["min"] = Function(["x", "y"], Builtin(min, [Name("x"), Name("y")]))
-    env.local_vars["max"] = Function(["x", "y"], Builtin(max, [Name("x"), Name("y")]))
+    env.local_vars["min"] = Function(["x", "y"], Builtin(min, [Name("x"), Name("y")]),
+                                     pure=True)
+    env.local_vars["max"] = Function(["x", "y"], Builtin(max, [Name("x"), Name("y")]),
+                                     pure=True)
 
     return env
 
 
-def run_file(fname: str, env: Environment) -> None:
+def report_error(e: PainError) -> None:
+    """
+    Print the traceback of a statement which failed to stderr.
+    """
+    print(repr(e), file=sys.stderr)
+
+
+def load_program(fname: str) -> list[Expression]:
+    """
+    Return the folded expressions parsed from the file <fname>. They are
+    cached, and only parsed again once the file is modified.
+
+    >>> load_program("test-scripts/print.pain") is load_program("test-scripts/print.pain")
+    True
+    """
+    stat = os.stat(fname)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _PROGRAM_CACHE.get(fname)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    with open(fname) as f:
+        parser = Parser(f.read())
+
+    expressions = [fold(e) for e in parser]
+    _PROGRAM_CACHE[fname] = (version, expressions)
+    return expressions
+
+
+def run_file(fname: str, env: Environment, verbose: bool = False) -> None:
     """
+    Run the program in the file <fname> in <env>. If <verbose>, the parsed
+    expressions are printed to stderr before they are run.
+
     >>> run_file("test-scripts/function_print_wrapper.pain", prepare_environment())
     Custom Print
     >>> env = Environment({})
@@ -55,26 +97,22 @@ def run_file(fname: str, env: Environment) -> None:
     >>> run_file("test-scripts/if_elif.pain", prepare_environment())
     4 == 4 (3)
     """
-    expressions: list[Expression] = []
-
-    with open(fname) as f:
-        contents = f.read()
-        parser = Parser(contents)
-
-        while True:
-            expr = parser.parse_line()
-            if expr is not None:
-                expressions.append(expr)
-            else:
-                break
-
-    for e in expressions:
-        e.evaluate(env)
+    expressions = load_program(fname)
+    if verbose:
+        for e in expressions:
+            print(e, file=sys.stderr)
+    link(expressions, env)
+    run(compile_program(expressions), env, report_error)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) == 2:
-        run_file(sys.argv[1], prepare_environment())
+    # usage: main.py [-v] file
+    args = sys.argv[1:]
+    verbose = "-v" in args
+    if verbose:
+        args.remove("-v")
+    if len(args) == 1:
+        run_file(args[0], prepare_environment(), verbose)
     else:
         import doctest
         doctest.testmod()
@@ -1,51 +1,178 @@
-from expression import Block, Expression, Function, IfBlock, Invocation, Name, Operation, Constant, Environment, ForLoop, RetVal, WhileLoop
-from tokenizer import Tokenizer, TokenType, Token
+from expression import Block, Expression, Function, IfBlock, Invalid, Invocation, Name, Operation, Constant, Environment, ForLoop, PainError, RetVal, WhileLoop
+from tokenizer import ROTATING_TOKEN_OFFSET, Tokenizer, TokenType, Token
+from typing import Iterator
+
+
+# dict[TokenType, int]
+# [binary operator, its precedence]; operators with a higher precedence bind
+# more tightly, and all of them associate to the left
+PRECEDENCES = \
+{
+    TokenType.OR: 1,
+    TokenType.AND: 2,
+    TokenType.EQUAL: 3,
+    TokenType.LESS_EQUAL: 3,
+    TokenType.LESS_THAN: 3,
+    TokenType.GREATER_EQUAL: 3,
+    TokenType.GREATER_THAN: 3,
+    TokenType.ADD: 4,
+    TokenType.SUBTRACT: 4,
+    TokenType.MULTIPLY: 5,
+    TokenType.DIVIDE: 5,
+    TokenType.MOD: 5,
+}
+LOWEST_PRECEDENCE = 1
+COMPARISON_PRECEDENCE = 3
+# Operands of operators with a lower precedence than this may be a unary
+# operation or a return (see parse_term)
+ADD_SUB_PRECEDENCE = 4
+
+# frozenset[TokenType]
+# The tokens which get_as_expression turns into a Constant
+LITERALS = frozenset({TokenType.FLOAT, TokenType.INT, TokenType.STRING})
+
+# dict[tuple[TokenType, int], Constant]
+# [(TokenType.INT, value), its Constant]; the Constants of small integers,
+# which are shared by every parse to start its leaves from. Built once and
+# never extended, so arbitrary literals of a script are not kept alive
+SMALL_INT_CONSTANTS = {(TokenType.INT, value): Constant(value)
+                       for value in range(0, 256)}
+
+# Looked up once per line by parse_line
+EOL = TokenType.EOL
+
+# frozenset[TokenType]
+# The tokens at which parse_line finds no (further) line to parse
+LINE_ENDS = frozenset({TokenType.EOF, TokenType.EOL, TokenType.CLOSING_BLOCK,
+                       TokenType.CLOSING_PAR})
 
 
 class Parser:
     """
     Parse a string using Tokenizer into a tree of Expressions.
     """
-    tokenizer: Tokenizer
+    tokens: list[Token]
+    # The type of each token in tokens
+    types: list[TokenType]
+    position: int
+    # dict[tuple[TokenType, Union[str, int, float]], Expression]
+    # [(type, payload) of a literal or name token, the Constant or Name shared
+    # by all of them]
+    leaves: dict
+    __slots__ = ('tokens', 'types', 'position', 'leaves')
 
 
     def __init__(self, script: str) -> None:
         """
-        Initialize the Tokenizer on the given script.
+        Tokenize the whole script, which is then parsed by moving position
+        through tokens.
         """
-        self.tokenizer = Tokenizer(script)
+        self.tokens = Tokenizer(script).tokenize()
+        self.types = [token.token_type for token in self.tokens]
+        self.position = 0
+        self.leaves = dict(SMALL_INT_CONSTANTS)
+
+
+    def peek_next_token(self) -> Token:
+        """
+        Return the next token without advancing to it.
+        """
+        return self.tokens[self.position]
+
+
+    def peek_type(self) -> TokenType:
+        """
+        Return the type of the next token without advancing to it.
+        """
+        return self.types[self.position]
+
+
+    def get_next_token(self) -> Token:
+        """
+        Return the next token and advance past it. The final EOF token is
+        returned again on every call.
+
+        >>> p = Parser("a")
+        >>> p.get_next_token(), p.get_next_token(), p.get_next_token()
+        (Token<Type: NAME, Payload: a>, Token<Type: EOF, Payload: None>, Token<Type: EOF, Payload: None>)
+        """
+        token = self.tokens[self.position]
+        if token.token_type is not TokenType.EOF:
+            self.position += 1
+        return token
+
+    
+    def __iter__(self) -> Iterator[Expression]:
+        """
+        Parse and yield one line at a time, until the end of the script.
+
+        >>> list(Parser("a E 1| print)a("))
+        [Operation<Constant<Name<a>>, TokenType.ASSIGN, Constant<1>>, Invocation<print, [Name<a>]>]
+        """
+        expr = self.parse_line()
+        while expr is not None:
+            yield expr
+            expr = self.parse_line()
 
     
     def get_as_expression(self, token: Token) -> Expression:
         """
         Turn a token into token.
 
-        Possible for float, int and string tokens.
-        """
-        if token.is_token_type(TokenType.FLOAT) or token.is_token_type(TokenType.INT) \
-            or token.is_token_type(TokenType.STRING):
-            return Constant(token.payload)
-        elif token.is_token_type(TokenType.NAME):
-            return Name(token.payload)
+        Possible for float, int, string and name tokens. Equal tokens share
+        one Constant or Name, neither of which is modified after parsing;
+        small integers share theirs with every other parse.
 
-        raise Exception(f"Cannot map token of type {token.token_type} directly to Expression")
+        >>> p = Parser("1 A 1 B 1.0")
+        >>> tree = p.parse_expression()
+        >>> tree.r_operand, tree.l_operand.l_operand is tree.l_operand.r_operand
+        (Constant<1.0>, True)
+        >>> tree = Parser("a C a").parse_expression()
+        >>> tree.l_operand is tree.r_operand
+        True
+        >>> Parser("1").parse_expression() is Parser("1").parse_expression()
+        True
+        """
+        token_type = token.token_type
+        # The type is part of the key, as 1 == 1.0
+        key = (token_type, token.payload)
+        leaf = self.leaves.get(key)
+        if leaf is None:
+            if token_type in LITERALS:
+                leaf = Constant(token.payload)
+            elif token_type is TokenType.NAME:
+                leaf = Name(token.payload)
+            else:
+                raise Exception(f"Cannot map token of type TokenType.{token.token_type.name} directly to Expression")
+            self.leaves[key] = leaf
+        return leaf
 
 
     def parse_unitary_operator(self) -> Expression:
         """
         Parse an operator which only has one operand to the right of it.
+
+        An operator which can not be applied (like TO_INT) is parsed into an
+        Invalid, so only the statement using it fails once it is run.
+
+        >>> Parser("K 5").parse_line()
+        Invalid<Operator 'TokenType.TO_INT' is invalid.>
         """
-        operator = self.tokenizer.get_next_token().token_type
-        return Operation(None, operator, self.parse_line())
+        operator = self.get_next_token().token_type
+        operand = self.parse_line()
+        try:
+            return Operation(None, operator, operand)
+        except PainError as e:
+            return Invalid(e.traceback[0][1])
 
 
     def parse_return(self) -> Expression:
         """
         """
-        operator = self.tokenizer.get_next_token().token_type
-        assert operator == TokenType.RETURN
+        operator = self.get_next_token().token_type
+        assert operator is TokenType.RETURN
 
-        return Operation(None, operator, self.parse_or())
+        return Operation(None, operator, self.parse_expression())
 
 
     def parse_parentheses(self) -> Expression:
@@ -53,142 +180,104 @@ class Parser:
         Parse a set of parentheses (Highest priority),
         or just return the value if there are no parentheses.
         """
-        next_token = self.tokenizer.peek_next_token()
-
-        if next_token.is_token_type(TokenType.OPEN_PAR):
-            self.tokenizer.get_next_token()
-            term = self.parse_comparison()
-            self.tokenizer.get_next_token()
+        position = self.position
+        if self.types[position] is TokenType.OPEN_PAR:
+            self.position = position + 1
+            term = self.parse_expression(COMPARISON_PRECEDENCE)
+            self.get_next_token()
             return term
         else:
-            return self.get_as_expression(self.tokenizer.get_next_token())
+            # Without the EOF check of get_next_token, which get_as_expression
+            # rejects anyway
+            self.position = position + 1
+            return self.get_as_expression(self.tokens[position])
 
     
     def parse_invocation(self) -> Expression:
         """
         Parse a function invocation.
         """
+        get_next_token = self.get_next_token
         l_operand = self.parse_parentheses()
-        next_token = self.tokenizer.peek_next_token()
 
-        if next_token.is_token_type(TokenType.OPEN_PAR):
-            self.tokenizer.get_next_token()
+        if self.types[self.position] is TokenType.OPEN_PAR:
+            self.position += 1
+            parse_line = self.parse_line
             arguments = []
+            append = arguments.append
             next_operator = TokenType.COMMA
-            while next_operator == TokenType.COMMA:
-                arguments.append(self.parse_line())
-                next_operator = self.tokenizer.get_next_token().token_type
+            while next_operator is TokenType.COMMA:
+                append(parse_line())
+                next_operator = get_next_token().token_type
 
-            assert next_operator == TokenType.CLOSING_PAR
+            assert next_operator is TokenType.CLOSING_PAR
 
             return Invocation(l_operand.name, arguments)
         else:
             return l_operand
 
 
-    def parse_mul_div(self) -> Expression:
-        """
-        Parse multiplication, division or modulo arithmetic.
-        """
-        l_operand = self.parse_invocation()
-        next_token = self.tokenizer.peek_next_token()
-
-        if next_token.is_token_type(TokenType.MULTIPLY) \
-            or next_token.is_token_type(TokenType.DIVIDE) \
-            or next_token.is_token_type(TokenType.MOD):
-            operator = self.tokenizer.get_next_token().token_type
-
-            return Operation(l_operand, operator, self.parse_mul_div())
-        else:
-            return l_operand
-
-
-    def parse_add_sub(self) -> Expression:
-        """
-        Parse addition or subtraction.
-        """
-        l_operand = self.parse_mul_div()
-        next_token = self.tokenizer.peek_next_token()
-        
-        if next_token.is_token_type(TokenType.ADD) \
-            or next_token.is_token_type(TokenType.SUBTRACT):
-
-            operator = self.tokenizer.get_next_token().token_type
-            return Operation(l_operand, operator, self.parse_add_sub())
-        else:
-            return l_operand
-
-    
     def parse_term(self) -> Expression:
         """
-        Decide whether to parse with a unitary operator or a binary one.
-        """
-        left = self.tokenizer.peek_next_token()
-
-        if left.is_operator():
-            return self.parse_unitary_operator()
-        elif left.is_token_type(TokenType.RETURN):
-            return self.parse_return()
-        else:
-            return self.parse_add_sub()
-
-
-    def parse_comparison(self) -> Expression:
-        """
-        Parse a binary comparison.
+        Parse an operand of a binary operator: a unary operator, a return or
+        a (possibly invoked) value.
         """
-        l_operand = self.parse_term()
-        next_token = self.tokenizer.peek_next_token()
+        return TERM_PARSERS[self.types[self.position]](self)
 
-        if next_token.is_token_type(TokenType.EQUAL) \
-            or next_token.is_token_type(TokenType.LESS_EQUAL) \
-            or next_token.is_token_type(TokenType.LESS_THAN) \
-            or next_token.is_token_type(TokenType.GREATER_EQUAL) \
-            or next_token.is_token_type(TokenType.GREATER_THAN):
 
-            operator = self.tokenizer.get_next_token().token_type
-            return Operation(l_operand, operator, self.parse_comparison())
-        else:
-            return l_operand
-
-    
-    def parse_and(self) -> Expression:
+    def parse_expression(self, min_precedence: int = LOWEST_PRECEDENCE) -> Expression:
         """
-        Parse boolean and connective.
-        """
-        l_operand = self.parse_comparison()
-        next_token = self.tokenizer.peek_next_token()
+        Parse a chain of binary operations, of which only the operators with
+        at least <min_precedence> are included (precedence climbing).
 
-        if next_token.is_token_type(TokenType.AND):
-            operator = self.tokenizer.get_next_token().token_type
-            return Operation(l_operand, operator, self.parse_and())
-        else:
-            return l_operand
+        The operands and the operators still waiting for their right operand
+        are kept on stacks, so that the chain is parsed in one loop instead of
+        one call per precedence level.
 
-    
-    def parse_or(self) -> Expression:
-        """
-        Parse boolean or connective.
+        >>> Parser("1 A 2 D 3 H 4").parse_expression()
+        Operation<Operation<Constant<1>, TokenType.ADD, Operation<Constant<2>, TokenType.MULTIPLY, Constant<3>>>, TokenType.EQUAL, Constant<4>>
         """
-        l_operand = self.parse_and()
-        next_token = self.tokenizer.peek_next_token()
-
-        if next_token.is_token_type(TokenType.OR):
-            operator = self.tokenizer.get_next_token().token_type
-            return Operation(l_operand, operator, self.parse_or())
+        types = self.types
+        if min_precedence < ADD_SUB_PRECEDENCE:
+            operands = [self.parse_term()]
         else:
-            return l_operand
+            operands = [self.parse_invocation()]
+        # list[tuple[TokenType, int]]: [(operator, its precedence)]
+        operators = []
+
+        while True:
+            operator = types[self.position]
+            precedence = PRECEDENCES.get(operator)
+            if precedence is None or precedence < min_precedence:
+                break
+
+            # Operators of at least the same precedence to the left of this
+            # one associate first
+            while operators and operators[-1][1] >= precedence:
+                r_operand = operands.pop()
+                operands[-1] = Operation(operands[-1], operators.pop()[0], r_operand)
+
+            self.position += 1
+            operators.append((operator, precedence))
+            if precedence < ADD_SUB_PRECEDENCE:
+                operands.append(self.parse_term())
+            else:
+                operands.append(self.parse_invocation())
+
+        while operators:
+            r_operand = operands.pop()
+            operands[-1] = Operation(operands[-1], operators.pop()[0], r_operand)
+        return operands[0]
 
     
     def parse_assignment(self) -> Expression:
         """
         Parse an assignment statement.
         """
-        l_operand = self.parse_or()
-        next_token = self.tokenizer.peek_next_token()
+        l_operand = self.parse_expression()
 
-        if next_token.is_token_type(TokenType.ASSIGN):
-            operator = self.tokenizer.get_next_token().token_type
+        if self.types[self.position] is TokenType.ASSIGN:
+            operator = self.get_next_token().token_type
             assert isinstance(l_operand, Name)
             return Operation(Constant(l_operand), operator, self.parse_line())
         else:
@@ -199,43 +288,51 @@ class Parser:
         """
         Parse a block statement (which will have its own environment).
         """
-        next_token = self.tokenizer.get_next_token()
-        assert next_token.is_token_type(TokenType.OPEN_BLOCK)
+        get_next_token = self.get_next_token
+        parse_line = self.parse_line
+        next_token = get_next_token()
+        assert next_token.token_type is TokenType.OPEN_BLOCK
 
         expressions = []
-        expr = self.parse_line()
+        append = expressions.append
+        expr = parse_line()
 
         while expr is not None:
-            expressions.append(expr)
-            expr = self.parse_line()
+            append(expr)
+            expr = parse_line()
 
-        next_token = self.tokenizer.get_next_token()
-        assert next_token.is_token_type(TokenType.CLOSING_BLOCK)
+        next_token = get_next_token()
+        assert next_token.token_type is TokenType.CLOSING_BLOCK
 
         return Block(expressions)
 
 
     def parse_conditional(self, has_cond=False) -> Expression:
         """
-        Parse an "if" conditional statement.
-        """
-        self.tokenizer.get_next_token()
-        condition = self.parse_line() if has_cond else Constant(True)
-        block = self.parse_block()
-        branches = [(condition, block)]
-        
-        right = self.tokenizer.peek_next_token()
-        """while right.is_token_type(TokenType.EOL) \
-            or right.is_token_type(TokenType.CLOSING_BLOCK):
-            self.tokenizer.get_next_token()
-            right = self.tokenizer.peek_next_token()
-        """
-        if has_cond:
-            if right.is_token_type(TokenType.ELIF):
-                branches += self.parse_conditional(True).steps
-            elif right.is_token_type(TokenType.ELSE):
-                branches += self.parse_conditional(False).steps
-        
+        Parse an "if" conditional statement, with all of its "elif" and
+        "else" branches.
+
+        >>> Parser("IF a [1] ELIF b [2] ELSE [3]").parse_line()
+        IfBlock<[(Name<a>, Block<[Constant<1>]>), (Name<b>, Block<[Constant<2>]>), (Constant<True>, Block<[Constant<3>]>)]>
+        """
+        get_next_token = self.get_next_token
+        branches = []
+        while True:
+            get_next_token()
+            condition = self.parse_line() if has_cond else Constant(True)
+            branches.append((condition, self.parse_block()))
+
+            # Nothing can follow an "else" branch
+            if not has_cond:
+                break
+            token_type = self.peek_type()
+            if token_type is TokenType.ELIF:
+                has_cond = True
+            elif token_type is TokenType.ELSE:
+                has_cond = False
+            else:
+                break
+
         return IfBlock(branches)
     
 
@@ -243,7 +340,7 @@ class Parser:
         """
         Parse a while loop.
         """
-        self.tokenizer.get_next_token()
+        self.get_next_token()
         condition = self.parse_line()
         block = self.parse_block()
         return WhileLoop(condition, block)
@@ -253,18 +350,20 @@ class Parser:
         """
         Parse an ordinary for loop.
         """
-        self.tokenizer.get_next_token()
-        next_token = self.tokenizer.get_next_token()
-        assert next_token.is_token_type(TokenType.OPEN_BLOCK)
+        get_next_token = self.get_next_token
+        parse_line = self.parse_line
+        get_next_token()
+        next_token = get_next_token()
+        assert next_token.token_type is TokenType.OPEN_BLOCK
         
         cond_exprs = []
-        expr = self.parse_line()
+        expr = parse_line()
         while expr is not None:
             cond_exprs.append(expr)
-            expr = self.parse_line()
+            expr = parse_line()
         assert len(cond_exprs) == 3
 
-        self.tokenizer.get_next_token()
+        get_next_token()
 
         block = self.parse_block()
         return ForLoop(cond_exprs[0], cond_exprs[1], cond_exprs[2], block)
@@ -274,12 +373,14 @@ class Parser:
         """
         Parse the declaration of a function.
         """
-        self.tokenizer.get_next_token()
+        peek_type = self.peek_type
+        get_next_token = self.get_next_token
+        get_next_token()
 
         params = []
-        while self.tokenizer.peek_next_token().token_type != TokenType.OPEN_BLOCK:
-            name = self.tokenizer.get_next_token()
-            assert name.is_token_type(TokenType.NAME)
+        while peek_type() is not TokenType.OPEN_BLOCK:
+            name = get_next_token()
+            assert name.token_type is TokenType.NAME
             params.append(name.payload)
 
         block = self.parse_block()
@@ -301,9 +402,11 @@ class Parser:
         >>> p = Parser("5 A 6 B 3")
         >>> tree = p.parse_line()
         >>> tree
-        Operation<Constant<5>, TokenType.ADD, Operation<Constant<6>, TokenType.ADD, Constant<3>>>
+        Operation<Operation<Constant<5>, TokenType.ADD, Constant<6>>, TokenType.ADD, Constant<3>>
         >>> tree.evaluate({})
         14
+        >>> Parser("10 B 3 C 2").parse_line().evaluate({})
+        5
         >>> Parser("3 C )5 B 6(").parse_line().evaluate({})
         33
         >>> Parser("5 C 6").parse_line().evaluate({})
@@ -341,27 +444,46 @@ class Parser:
         >>> tree
         Constant<Function<['a'], Block<[Operation<Name<a>, TokenType.ADD, Constant<10>>]>>>
         """
-        right = self.tokenizer.peek_next_token()
-
-        while right.is_token_type(TokenType.EOL):
-            self.tokenizer.get_next_token()
-            right = self.tokenizer.peek_next_token()
-
-        if right.is_token_type(TokenType.IF):
-            return self.parse_conditional(True)
-        elif right.is_token_type(TokenType.WHILE_LOOP):
-            return self.parse_while_loop()
-        elif right.is_token_type(TokenType.FOR_LOOP):
-            return self.parse_for_loop()
-        elif right.is_token_type(TokenType.FUNC_DECL):
-            return self.parse_function_declaration()
-        elif not right.is_token_type(TokenType.EOF) and not right.is_token_type(TokenType.EOL) \
-            and not right.is_token_type(TokenType.CLOSING_BLOCK) \
-            and not right.is_token_type(TokenType.CLOSING_PAR):
-            return self.parse_assignment()
-        else:
-            return None
-            
+        types = self.types
+        token_type = types[self.position]
+
+        while token_type is EOL:
+            self.position += 1
+            token_type = types[self.position]
+
+        line_parser = LINE_PARSERS[token_type]
+        if line_parser is not None:
+            return line_parser(self)
+        return None
+
+
+# dict[TokenType, Callable[[Parser], Expression]]
+# [first token of a statement, the method of Parser which parses it]
+STATEMENT_PARSERS = \
+{
+    TokenType.IF: lambda parser: parser.parse_conditional(True),
+    TokenType.WHILE_LOOP: Parser.parse_while_loop,
+    TokenType.FOR_LOOP: Parser.parse_for_loop,
+    TokenType.FUNC_DECL: Parser.parse_function_declaration,
+}
+
+# list[Optional[Callable[[Parser], Expression]]]
+# [index: the type of the first token of a line, the method of Parser which
+# parses it, or None if no line starts there]
+LINE_PARSERS = [None] * len(TokenType)
+for token_type in TokenType:
+    if token_type not in LINE_ENDS:
+        LINE_PARSERS[token_type] = STATEMENT_PARSERS.get(token_type, Parser.parse_assignment)
+
+# list[Callable[[Parser], Expression]]
+# [index: the type of the first token of an operand, the method of Parser which
+# parses it]
+TERM_PARSERS = [Parser.parse_invocation] * len(TokenType)
+TERM_PARSERS[TokenType.RETURN] = Parser.parse_return
+for token_type in TokenType:
+    if token_type >= ROTATING_TOKEN_OFFSET:
+        TERM_PARSERS[token_type] = Parser.parse_unitary_operator
+
 
 if __name__ == "__main__":
     import doctest
@@ -1,12 +1,52 @@
 import enum
+import re
 from typing import Union
 
 
 ROTATING_TOKEN_COUNT = 17
 ROTATING_TOKEN_OFFSET = 20
 
-
-class TokenType(enum.Enum):
+# The classes of characters which get_next_token tells apart by the first
+# character of a token
+CHAR_OTHER = 0
+CHAR_PUNCTUATION = 1
+CHAR_DIGIT = 2
+CHAR_QUOTE = 3
+CHAR_UPPER = 4
+CHAR_ALPHA = 5
+
+# The runs of characters which the tokenizer skips or takes as a whole, matched
+# by the regex engine instead of a Python loop per character. Only ASCII is
+# matched for numbers, names and keywords; a run continuing with other
+# characters is finished with the str methods, as before.
+SPACES = re.compile(r"\s*")
+ASCII_NUMBER = re.compile(r"[0-9]*(\.[0-9]*)?")
+ASCII_LETTERS = re.compile(r"[A-Za-z]*")
+ASCII_UPPER = re.compile(r"[A-Z]*")
+
+# The whitespace and comments before a token and the token itself, of an
+# ASCII script. Like get_next_token, the character after a keyword or an
+# operator is skipped. The numbered groups tell the kinds of tokens apart.
+TOKEN_PATTERN = re.compile(r"""
+    (?=((?:\s|\#[^\n]*)*))\1  # 1: skipped, never given back to the token
+    (?:
+        ([)(|,\[\]])           # 2: punctuation
+      | ([0-9]+(?:\.[0-9]*)?)   # 3: number
+      | "([^"]*)"?             # 4: string
+      | ([A-Z]+)(?s:.)?        # 5: operator or keyword
+      | ([a-z][A-Za-z]*)       # 6: name
+      | ((?s:.))               # 7: a character which starts no token
+    )
+""", re.VERBOSE)
+TOKEN_PUNCTUATION = 2
+TOKEN_NUMBER = 3
+TOKEN_STRING = 4
+TOKEN_UPPER = 5
+TOKEN_NAME = 6
+
+
+@enum.unique
+class TokenType(enum.IntEnum):
     """
     The type which a token has. There are a few subtypes:
     UNKNOWN and EOF as control tokens,
@@ -58,7 +98,7 @@ class TokenType(enum.Enum):
         """
         Checks whether a given token is an operator.
         """
-        return self.value >= ROTATING_TOKEN_OFFSET
+        return self >= ROTATING_TOKEN_OFFSET
 
 
 class Token:
@@ -67,6 +107,7 @@ class Token:
     """
     token_type: TokenType
     payload: Union[str, int]
+    __slots__ = ('token_type', 'payload')
 
 
     def __init__(self, token_type: TokenType, payload: Union[str, int, float] = None) -> None:
@@ -98,6 +139,79 @@ class Token:
         return self.token_type == token_type
 
 
+# The tokens without a payload are made once and shared by every Tokenizer;
+# they must not be modified
+EOF_TOKEN = Token(TokenType.EOF)
+UNKNOWN_TOKEN = Token(TokenType.UNKNOWN)
+
+# dict[str, Token]
+# [character, the (shared) token it forms on its own]
+PUNCTUATION_TOKENS = \
+{
+    ")": Token(TokenType.OPEN_PAR),
+    "(": Token(TokenType.CLOSING_PAR),
+    "|": Token(TokenType.EOL),
+    ",": Token(TokenType.COMMA),
+    "[": Token(TokenType.OPEN_BLOCK),
+    "]": Token(TokenType.CLOSING_BLOCK),
+}
+
+# dict[str, Token]
+# [keyword, the (shared) token it forms]
+KEYWORD_TOKENS = \
+{
+    "IF": Token(TokenType.IF),
+    "ELIF": Token(TokenType.ELIF),
+    "ELSE": Token(TokenType.ELSE),
+    "FOR": Token(TokenType.FOR_LOOP),
+    "WHILE": Token(TokenType.WHILE_LOOP),
+    "FUN": Token(TokenType.FUNC_DECL),
+    "RET": Token(TokenType.RETURN),
+}
+
+
+def char_class_of(char: str) -> int:
+    """
+    Return the class (one of the CHAR_ constants) of a character.
+
+    >>> char_class_of("("), char_class_of("7"), char_class_of("Q"), char_class_of("é")
+    (1, 2, 4, 5)
+    """
+    if char in PUNCTUATION_TOKENS:
+        return CHAR_PUNCTUATION
+    elif char.isdigit():
+        return CHAR_DIGIT
+    elif char == "\"":
+        return CHAR_QUOTE
+    elif char.isupper():
+        return CHAR_UPPER
+    elif char.isalpha():
+        return CHAR_ALPHA
+    return CHAR_OTHER
+
+
+# list[int]
+# [index: an ASCII code, the class of its character], so that the common
+# characters are classified with a single lookup
+CHAR_CLASSES = [char_class_of(chr(code)) for code in range(128)]
+
+
+OPERATOR_LETTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+# list[list[Token]]
+# [index: shift, [index: position of a letter in OPERATOR_LETTERS, the
+# (shared) operator token it stands for]]
+OPERATOR_TOKENS = [
+    [Token(TokenType((letter - shift) % ROTATING_TOKEN_COUNT + ROTATING_TOKEN_OFFSET))
+     for letter in range(len(OPERATOR_LETTERS))]
+    for shift in range(ROTATING_TOKEN_COUNT)
+]
+
+# tuple[int, ...]
+# [index: shift, the shift after one more operator]
+NEXT_SHIFTS = tuple(range(1, ROTATING_TOKEN_COUNT)) + (0,)
+
+
 class Tokenizer:
     """
     TODO: Error handling
@@ -107,7 +221,7 @@ class Tokenizer:
     script: str
     index: int
     shift: int
-    next_token: Token
+    __slots__ = ('script', 'index', 'shift')
 
 
     def __init__(self, script: str) -> None:
@@ -117,7 +231,6 @@ class Tokenizer:
         self.script = script
         self.index = -1
         self.shift = 0
-        self.next_token = None
 
 
     def _get_numerical_token(self) -> Token:
@@ -127,25 +240,27 @@ class Tokenizer:
         PRECONDITIONS:
         The current character already is a digit.
         """
+        script = self.script
         start = self.index
-        self.index += 1
+        match = ASCII_NUMBER.match(script, start + 1)
+        end = match.end()
+        is_float = match.group(1) is not None
 
-        is_float = False
+        if end < len(script) and script[end] >= "\x80":
+            while end < len(script):
+                if not script[end].isdigit():
+                    if script[end] == "." and not is_float:
+                        is_float = True
+                    else:
+                        break
+                end += 1
 
-        while self.index < len(self.script):
-            if not self.script[self.index].isdigit():
-                if self.script[self.index] == "." and not is_float:
-                    is_float = True
-                else:
-                    break
-            self.index += 1
-
-        self.index -= 1
+        self.index = end - 1
 
         if is_float:
-            return Token(TokenType.FLOAT, float(self.script[start:self.index + 1]))
+            return Token(TokenType.FLOAT, float(script[start:end]))
         else:
-            return Token(TokenType.INT, int(self.script[start:self.index + 1]))
+            return Token(TokenType.INT, int(script[start:end]))
 
 
     def _get_string_token(self) -> Token:
@@ -155,13 +270,14 @@ class Tokenizer:
         PRECONDITIONS:
         The current character is " and the string ends somewhere.
         """
+        script = self.script
         start = self.index + 1
-        self.index += 1
-
-        while self.index < len(self.script) and self.script[self.index] != "\"":
-            self.index += 1
+        end = script.find("\"", start)
+        if end < 0:
+            end = len(script)
 
-        return Token(TokenType.STRING, self.script[start:self.index])
+        self.index = end
+        return Token(TokenType.STRING, script[start:end])
 
 
     def _get_operator_token_from(self, operator_string: str) -> Token:
@@ -171,14 +287,17 @@ class Tokenizer:
         PRECONDIITONS:
         The current character is an uppercase letter corresponding to a valid operator.
         """
-        token = Token(TokenType(
-            (ord(operator_string) - ord("A") - self.shift) % ROTATING_TOKEN_COUNT
-            + ROTATING_TOKEN_OFFSET
-        ))
+        shift = self.shift
+        letter = ord(operator_string) - ord("A")
+        if letter < len(OPERATOR_LETTERS):
+            token = OPERATOR_TOKENS[shift][letter]
+        else:
+            # Other uppercase letters (outside ASCII) rotate like the letter
+            # congruent to them, so they share its row entry too
+            token = OPERATOR_TOKENS[shift][letter % ROTATING_TOKEN_COUNT]
         
         # Now shift the tokens
-        self.shift += 1
-        self.shift %= ROTATING_TOKEN_COUNT
+        self.shift = NEXT_SHIFTS[shift]
 
         return token
 
@@ -187,33 +306,31 @@ class Tokenizer:
         """
         Parse a control flow token, such as operator or keyword
         """
+        script = self.script
         start = self.index
-        self.index += 1
+        end = ASCII_UPPER.match(script, start + 1).end()
 
-        while self.index < len(self.script) and self.script[self.index].isupper():
-            self.index += 1
+        if end < len(script) and script[end] >= "\x80":
+            while end < len(script) and script[end].isupper():
+                end += 1
 
-        if self.index - start == 1:
-            return self._get_operator_token_from(self.script[start])
+        self.index = end
+        if end - start == 1:
+            return self._get_operator_token_from(script[start])
         else:
-            keyword = self.script[start:self.index]
-
-            if keyword == "IF":
-                return Token(TokenType.IF)
-            elif keyword == "ELIF":
-                return Token(TokenType.ELIF)
-            elif keyword == "ELSE":
-                return Token(TokenType.ELSE)
-            elif keyword == "FOR":
-                return Token(TokenType.FOR_LOOP)
-            elif keyword == "WHILE":
-                return Token(TokenType.WHILE_LOOP)
-            elif keyword == "FUN":
-                return Token(TokenType.FUNC_DECL)
-            elif keyword == "RET":
-                return Token(TokenType.RETURN)
-            else:
-                assert False
+            return self._get_keyword_token(script[start:end])
+
+
+    def _get_keyword_token(self, keyword: str) -> Token:
+        """
+        Return the token of a keyword.
+
+        PRECONDITIONS:
+        The keyword exists.
+        """
+        token = KEYWORD_TOKENS.get(keyword)
+        assert token is not None
+        return token
 
 
     def _get_name_token(self) -> Token:
@@ -223,25 +340,98 @@ class Tokenizer:
         PRECONDITIONS:
         The current character is alpha.
         """
+        script = self.script
         start = self.index
-        self.index += 1
-
-        while self.index < len(self.script) and self.script[self.index].isalpha():
-            self.index += 1
+        end = ASCII_LETTERS.match(script, start + 1).end()
 
-        self.index -= 1
+        if end < len(script) and script[end] >= "\x80":
+            while end < len(script) and script[end].isalpha():
+                end += 1
 
-        return Token(TokenType.NAME, payload=self.script[start:self.index + 1])
+        self.index = end - 1
+        return Token(TokenType.NAME, payload=script[start:end])
 
 
     def peek_next_token(self) -> Token:
         """
         Returns the next token without advancing to that position.
+
+        >>> t = Tokenizer("A A")
+        >>> t.peek_next_token(), t.get_next_token(), t.get_next_token()
+        (Token<Type: ADD, Payload: None>, Token<Type: ADD, Payload: None>, Token<Type: MOD, Payload: None>)
         """
-        if self.next_token is None:
-            self.next_token = self.get_next_token()
-        
-        return self.next_token  
+        # Scanning has no effects besides index and shift, so the token is
+        # simply scanned again by get_next_token
+        index = self.index
+        shift = self.shift
+        token = self.get_next_token()
+        self.index = index
+        self.shift = shift
+        return token
+
+
+    def tokenize(self) -> list[Token]:
+        """
+        Return all remaining tokens of the script, ending with EOF.
+
+        >>> Tokenizer("a E 1|").tokenize()
+        [Token<Type: NAME, Payload: a>, Token<Type: ASSIGN, Payload: None>, Token<Type: INT, Payload: 1>, Token<Type: EOL, Payload: None>, Token<Type: EOF, Payload: None>]
+        """
+        tokens = []
+        if not self.script.isascii():
+            get_next_token = self.get_next_token
+            token = get_next_token()
+            while token is None or token.token_type is not TokenType.EOF:
+                # Characters which start no token are kept as UNKNOWN tokens
+                tokens.append(UNKNOWN_TOKEN if token is None else token)
+                token = get_next_token()
+            tokens.append(token)
+            return tokens
+
+        # All characters are ASCII, so TOKEN_PATTERN can find the tokens
+        # without the Unicode cases of get_next_token
+        script = self.script
+        append = tokens.append
+        match_token = TOKEN_PATTERN.match
+        shift = self.shift
+        # dict[str, Token]
+        # [name, its token]
+        name_tokens = {}
+        match = match_token(script, self.index + 1)
+        while match is not None:
+            kind = match.lastindex
+            if kind == TOKEN_NAME:
+                # A name is mostly used more than once, so its token is shared
+                word = match.group(kind)
+                token = name_tokens.get(word)
+                if token is None:
+                    token = name_tokens[word] = Token(TokenType.NAME, word)
+                append(token)
+            elif kind == TOKEN_UPPER:
+                word = match.group(kind)
+                if len(word) == 1:
+                    append(OPERATOR_TOKENS[shift][ord(word) - ord("A")])
+                    shift = NEXT_SHIFTS[shift]
+                else:
+                    append(self._get_keyword_token(word))
+            elif kind == TOKEN_PUNCTUATION:
+                append(PUNCTUATION_TOKENS[match.group(kind)])
+            elif kind == TOKEN_NUMBER:
+                number = match.group(kind)
+                if "." in number:
+                    append(Token(TokenType.FLOAT, float(number)))
+                else:
+                    append(Token(TokenType.INT, int(number)))
+            elif kind == TOKEN_STRING:
+                append(Token(TokenType.STRING, match.group(kind)))
+            else:
+                append(UNKNOWN_TOKEN)
+            match = match_token(script, match.end())
+
+        self.index = len(script)
+        self.shift = shift
+        append(EOF_TOKEN)
+        return tokens
 
 
     def get_next_token(self) -> Token:
@@ -285,55 +475,40 @@ class Tokenizer:
         >>> t.get_next_token()
         Token<Type: IF, Payload: None>
         """
-        if self.next_token is not None:
-            ret = self.next_token
-            self.next_token = None
-            return ret
-
-        self.index += 1
-        while self.index < len(self.script) and self.script[self.index].isspace():
-            self.index += 1
-
-        if self.index >= len(self.script):
-            return Token(TokenType.EOF)
-
-        while self.script[self.index] == "#":
-            while self.index < len(self.script) and self.script[self.index] != "\n":
-                self.index += 1
-            self.index += 1
-
-            if self.index >= len(self.script):
-                return Token(TokenType.EOF)
-
-            while self.index < len(self.script) and self.script[self.index].isspace():
-                self.index += 1
-
-        while self.index < len(self.script) and self.script[self.index].isspace():
-            self.index += 1
-
-        if self.script[self.index] == ")":
-            return Token(TokenType.OPEN_PAR)
-        elif self.script[self.index] == "(":
-            return Token(TokenType.CLOSING_PAR)
-        elif self.script[self.index] == "|":
-            return Token(TokenType.EOL)
-        elif self.script[self.index] == ",":
-            return Token(TokenType.COMMA)
-        elif self.script[self.index] == "[":
-            return Token(TokenType.OPEN_BLOCK)
-        elif self.script[self.index] == "]":
-            return Token(TokenType.CLOSING_BLOCK)
-        
-        if self.script[self.index].isdigit():
-            return self._get_numerical_token()
+        script = self.script
+        length = len(script)
+        index = self.index + 1
+        # Tokens are mostly separated by a single space; only anything else
+        # which may be whitespace needs the SPACES pattern
+        if index < length and script[index] == " ":
+            index += 1
+        if index < length and not " " < script[index] < "\x80":
+            index = SPACES.match(script, index).end()
+
+        # Comments run until the end of their line
+        while index < length and script[index] == "#":
+            newline = script.find("\n", index)
+            if newline < 0:
+                index = length
+            else:
+                index = SPACES.match(script, newline + 1).end()
 
-        if self.script[self.index] == "\"":
-            return self._get_string_token()
+        self.index = index
+        if index >= length:
+            return EOF_TOKEN
 
-        if self.script[self.index].isupper():
-            return self._get_control_flow_token()
+        char = script[index]
+        char_class = CHAR_CLASSES[ord(char)] if char < "\x80" else char_class_of(char)
 
-        if self.script[self.index].isalpha():
+        if char_class == CHAR_PUNCTUATION:
+            return PUNCTUATION_TOKENS[char]
+        elif char_class == CHAR_DIGIT:
+            return self._get_numerical_token()
+        elif char_class == CHAR_QUOTE:
+            return self._get_string_token()
+        elif char_class == CHAR_UPPER:
+            return self._get_control_flow_token()
+        elif char_class == CHAR_ALPHA:
             return self._get_name_token()
 
 
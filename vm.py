@@ -0,0 +1,353 @@
+from bisect import bisect_right
+from typing import Callable, Optional
+from expression import Environment, Function, Operators, OPERATORS, PainError, UNDEFINED, memo_key
+from compiler import Chunk, Opcode, compile_function
+from tokenizer import TokenType
+
+
+MAX_CALL_DEPTH = 10000
+
+LOAD_CONST = Opcode.LOAD_CONST.value
+LOAD_NAME = Opcode.LOAD_NAME.value
+STORE_NAME = Opcode.STORE_NAME.value
+POP_TOP = Opcode.POP_TOP.value
+BINARY_OP = Opcode.BINARY_OP.value
+UNARY_OP = Opcode.UNARY_OP.value
+LOAD_FUNC = Opcode.LOAD_FUNC.value
+CALL = Opcode.CALL.value
+CALL_BUILTIN = Opcode.CALL_BUILTIN.value
+RETURN_VALUE = Opcode.RETURN_VALUE.value
+JUMP = Opcode.JUMP.value
+JUMP_IF_FALSE = Opcode.JUMP_IF_FALSE.value
+ENTER_SCOPE = Opcode.ENTER_SCOPE.value
+EXIT_SCOPE = Opcode.EXIT_SCOPE.value
+EVAL_NODE = Opcode.EVAL_NODE.value
+ADD_NUMBER = Opcode.ADD_NUMBER.value
+SUBTRACT_NUMBER = Opcode.SUBTRACT_NUMBER.value
+MULTIPLY_NUMBER = Opcode.MULTIPLY_NUMBER.value
+LESS_THAN_NUMBER = Opcode.LESS_THAN_NUMBER.value
+LESS_EQUAL_NUMBER = Opcode.LESS_EQUAL_NUMBER.value
+GREATER_THAN_NUMBER = Opcode.GREATER_THAN_NUMBER.value
+GREATER_EQUAL_NUMBER = Opcode.GREATER_EQUAL_NUMBER.value
+EXTENDED_ARG = Opcode.EXTENDED_ARG.value
+
+# The operators of BINARY_OP which are applied inline
+ADD = TokenType.ADD.value
+SUBTRACT = TokenType.SUBTRACT.value
+MULTIPLY = TokenType.MULTIPLY.value
+DIVIDE = TokenType.DIVIDE.value
+MOD = TokenType.MOD.value
+EQUAL = TokenType.EQUAL.value
+GREATER_THAN = TokenType.GREATER_THAN.value
+GREATER_EQUAL = TokenType.GREATER_EQUAL.value
+LESS_THAN = TokenType.LESS_THAN.value
+LESS_EQUAL = TokenType.LESS_EQUAL.value
+AND = TokenType.AND.value
+OR = TokenType.OR.value
+
+# The operand types for which the *_NUMBER opcodes can use Python's operators
+# directly, instead of the checked functions in Operators
+NUMBER_TYPES = frozenset((int, float))
+
+
+def assign(env: Environment, name: str, value) -> None:
+    """
+    Assign <value> to <name> in the innermost environment of <env> which
+    defines it, or in <env> itself if none does (same as Name.assign).
+    """
+    scope = env
+    while scope is not None:
+        if name in scope.local_vars:
+            scope.local_vars[name] = value
+            return
+        scope = scope.parent_env
+    env.local_vars[name] = value
+
+
+def run(chunk: Chunk, env: Environment,
+        report: Optional[Callable[[PainError], None]] = None) -> None:
+    """
+    Execute the top-level statements in <chunk> in <env>.
+
+    A statement which fails, or returns a value, is abandoned and execution
+    continues with the next top-level statement, like evaluating each of them
+    with Expression.run. The PainError of a failed statement is passed to
+    <report> if given.
+
+    >>> from pain_parser import Parser
+    >>> from compiler import compile_program
+    >>> from expression import Block, Builtin, Name
+    >>> def run_script(script, env):
+    ...     run(compile_program(list(Parser(script))), env)
+    >>> env = Environment({'print': Function(['x'], Builtin(print, [Name('x')]))})
+    >>> run_script('f E FUN n [IF n K 2 [RET 1|] ELSE [RET f)n D 1( D f)n F 2(|]]', env)
+    >>> run_script('print)f)10((|', env)
+    55
+    >>> run_script('print)undefined(| print)"still running"(', env)
+    still running
+    >>> run(compile_program([Name('undefined')]), env, report=print)
+    Name 'undefined' is not defined.
+    >>> from expression import Constant, Operation, WhileLoop
+    >>> from tokenizer import TokenType
+    >>> def set_x(value):
+    ...     return Operation(Constant(Name('x')), TokenType.ASSIGN, value)
+    >>> count = WhileLoop(Operation(Name('x'), TokenType.LESS_THAN, Constant(70005)),
+    ...                   Block([set_x(Operation(Name('x'), TokenType.ADD, Constant(1)))]))
+    >>> chunk = compile_program([set_x(Constant(i)) for i in range(70000)] + [count])
+    >>> len(chunk.code) > 0xFFFF, len(chunk.consts) > 0xFFFF
+    (True, True)
+    >>> run(chunk, env)
+    >>> env.get_value('x')
+    70005
+    >>> run(compile_program(list(Parser('print)1(| K 5| print)2(|'))), env, report=print)
+    1
+    Operator 'TokenType.TO_INT' is invalid.
+    2
+    """
+    top_level = chunk
+    root_env = env
+    frames = []
+    # One operand stack is shared by the whole run; each frame records the
+    # height of the stack its function started with
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    pc = 0
+    while True:
+        code = chunk.code
+        consts = chunk.consts
+        names = chunk.names
+        try:
+            while pc < len(code):
+                op = code[pc]
+                if op == LOAD_NAME:
+                    name = names[code[pc + 1] | code[pc + 2] << 8]
+                    scope = env
+                    value = scope.local_vars.get(name, UNDEFINED)
+                    while value is UNDEFINED:
+                        scope = scope.parent_env
+                        if scope is None:
+                            raise PainError(f"Name \'{name}\' is not defined.")
+                        value = scope.local_vars.get(name, UNDEFINED)
+                    push(value)
+                    pc += 3
+                elif op == LOAD_CONST:
+                    push(consts[code[pc + 1] | code[pc + 2] << 8])
+                    pc += 3
+                elif op == BINARY_OP:
+                    # Same as the functions in Operators, without calling them
+                    operator = code[pc + 1]
+                    right = pop()
+                    left = stack[-1]
+                    try:
+                        if operator == ADD:
+                            stack[-1] = left + right
+                        elif operator == SUBTRACT:
+                            stack[-1] = left - right
+                        elif operator == LESS_THAN:
+                            stack[-1] = left < right
+                        elif operator == MULTIPLY:
+                            stack[-1] = left * right
+                        elif operator == EQUAL:
+                            stack[-1] = left == right
+                        elif operator == LESS_EQUAL:
+                            stack[-1] = left <= right
+                        elif operator == GREATER_THAN:
+                            stack[-1] = left > right
+                        elif operator == GREATER_EQUAL:
+                            stack[-1] = left >= right
+                        elif operator == DIVIDE:
+                            stack[-1] = left / right
+                        elif operator == MOD:
+                            stack[-1] = left % right
+                        elif operator == AND:
+                            stack[-1] = bool(left) and bool(right)
+                        elif operator == OR:
+                            stack[-1] = bool(left) or bool(right)
+                        else:
+                            stack[-1] = OPERATORS[operator][2](left, right, env)
+                    except (TypeError, ZeroDivisionError) as e:
+                        raise PainError(str(e))
+                    pc += 2
+                elif op == STORE_NAME:
+                    assign(env, names[code[pc + 1] | code[pc + 2] << 8], pop())
+                    pc += 3
+                elif op == JUMP_IF_FALSE:
+                    try:
+                        cond = bool(pop())
+                    except TypeError as te:
+                        raise PainError(str(te))
+                    pc = pc + 3 if cond else code[pc + 1] | code[pc + 2] << 8
+                elif op == JUMP:
+                    pc = code[pc + 1] | code[pc + 2] << 8
+                elif op == ADD_NUMBER:
+                    right = pop()
+                    left = stack[-1]
+                    if type(left) in NUMBER_TYPES and type(right) in NUMBER_TYPES:
+                        stack[-1] = left + right
+                    else:
+                        stack[-1] = Operators.add(left, right, env)
+                    pc += 1
+                elif op == SUBTRACT_NUMBER:
+                    right = pop()
+                    left = stack[-1]
+                    if type(left) in NUMBER_TYPES and type(right) in NUMBER_TYPES:
+                        stack[-1] = left - right
+                    else:
+                        stack[-1] = Operators.sub(left, right, env)
+                    pc += 1
+                elif op == MULTIPLY_NUMBER:
+                    right = pop()
+                    left = stack[-1]
+                    if type(left) in NUMBER_TYPES and type(right) in NUMBER_TYPES:
+                        stack[-1] = left * right
+                    else:
+                        stack[-1] = Operators.mul(left, right, env)
+                    pc += 1
+                elif op == LESS_THAN_NUMBER:
+                    right = pop()
+                    left = stack[-1]
+                    if type(left) in NUMBER_TYPES and type(right) in NUMBER_TYPES:
+                        stack[-1] = left < right
+                    else:
+                        stack[-1] = Operators.les(left, right, env)
+                    pc += 1
+                elif op == LESS_EQUAL_NUMBER:
+                    right = pop()
+                    left = stack[-1]
+                    if type(left) in NUMBER_TYPES and type(right) in NUMBER_TYPES:
+                        stack[-1] = left <= right
+                    else:
+                        stack[-1] = Operators.leq(left, right, env)
+                    pc += 1
+                elif op == GREATER_THAN_NUMBER:
+                    right = pop()
+                    left = stack[-1]
+                    if type(left) in NUMBER_TYPES and type(right) in NUMBER_TYPES:
+                        stack[-1] = left > right
+                    else:
+                        stack[-1] = Operators.grt(left, right, env)
+                    pc += 1
+                elif op == GREATER_EQUAL_NUMBER:
+                    right = pop()
+                    left = stack[-1]
+                    if type(left) in NUMBER_TYPES and type(right) in NUMBER_TYPES:
+                        stack[-1] = left >= right
+                    else:
+                        stack[-1] = Operators.geq(left, right, env)
+                    pc += 1
+                elif op == LOAD_FUNC:
+                    name = names[code[pc + 1] | code[pc + 2] << 8]
+                    func = env.get_value(name)
+                    if not isinstance(func, Function):
+                        raise PainError(f"Symbol \'{name}\' is not a function.")
+                    push(func)
+                    pc += 3
+                elif op == CALL:
+                    nargs = code[pc + 1]
+                    args = stack[len(stack) - nargs:]
+                    del stack[len(stack) - nargs:]
+                    func = pop()
+                    if len(args) != len(func.params):
+                        name = names[code[pc + 2] | code[pc + 3] << 8]
+                        raise PainError(f"Function \'{name}\' requires exactly "
+                                        f"{len(func.params)} parameters.")
+                    if func._pure:
+                        key = memo_key(args)
+                        value = func._cache.get(key, UNDEFINED)
+                        if value is not UNDEFINED:
+                            push(value)
+                            pc += 4
+                            continue
+                        memo = (func, key)
+                    else:
+                        memo = None
+                    if len(frames) >= MAX_CALL_DEPTH:
+                        raise PainError("Maximum call depth exceeded.")
+                    frames.append((chunk, pc, env, len(stack), memo))
+                    if func._chunk is None:
+                        func._chunk = compile_function(func)
+                    chunk = func._chunk
+                    env = Environment(dict(zip(func.params, args)), env)
+                    code = chunk.code
+                    consts = chunk.consts
+                    names = chunk.names
+                    pc = 0
+                elif op == RETURN_VALUE:
+                    if not frames:
+                        break
+                    value = pop()
+                    (chunk, pc, env, height, memo) = frames.pop()
+                    del stack[height:]
+                    if memo is not None:
+                        memo[0].remember(memo[1], value)
+                    pc += 4
+                    code = chunk.code
+                    consts = chunk.consts
+                    names = chunk.names
+                    push(value)
+                elif op == POP_TOP:
+                    pop()
+                    pc += 1
+                elif op == ENTER_SCOPE:
+                    env = Environment({}, env)
+                    pc += 1
+                elif op == EXIT_SCOPE:
+                    env = env.parent_env
+                    pc += 1
+                elif op == CALL_BUILTIN:
+                    nargs = code[pc + 1]
+                    args = stack[len(stack) - nargs:]
+                    del stack[len(stack) - nargs:]
+                    try:
+                        push(consts[code[pc + 2] | code[pc + 3] << 8](*args))
+                    except Exception as e:
+                        raise PainError(str(e))
+                    pc += 4
+                elif op == UNARY_OP:
+                    stack[-1] = OPERATORS[code[pc + 1]][2](stack[-1], env)
+                    pc += 2
+                elif op == EVAL_NODE:
+                    push(consts[code[pc + 1] | code[pc + 2] << 8].evaluate(env))
+                    pc += 3
+                elif op == EXTENDED_ARG:
+                    # Only in chunks too large for two-byte operands, so the
+                    # instruction it extends is executed here
+                    arg = (code[pc + 1] | code[pc + 2] << 8) << 16 \
+                        | code[pc + 4] | code[pc + 5] << 8
+                    op = code[pc + 3]
+                    if op == LOAD_CONST:
+                        push(consts[arg])
+                        pc += 6
+                    elif op == EVAL_NODE:
+                        push(consts[arg].evaluate(env))
+                        pc += 6
+                    elif op == JUMP:
+                        pc = arg
+                    elif op == JUMP_IF_FALSE:
+                        try:
+                            cond = bool(pop())
+                        except TypeError as te:
+                            raise PainError(str(te))
+                        pc = pc + 6 if cond else arg
+                    else:
+                        raise PainError(f"Invalid opcode {op} after EXTENDED_ARG.")
+                else:
+                    raise PainError(f"Invalid opcode {op}.")
+            else:
+                return
+        except PainError as e:
+            if report is not None:
+                report(e)
+
+        # The current top-level statement failed or returned, skip the rest
+        if frames:
+            pc = frames[0][1]
+            frames.clear()
+        chunk = top_level
+        env = root_env
+        stack.clear()
+        next_statement = bisect_right(top_level.statements, pc)
+        if next_statement >= len(top_level.statements):
+            return
+        pc = top_level.statements[next_statement]